@@ -2,45 +2,37 @@
 from flask import Flask, request, jsonify, Response, stream_with_context, send_from_directory, session, redirect, url_for
 from flask import send_file, abort
 from flask_cors import CORS
-import tensorflow as tf
-import numpy as np
-from numpy import asarray
-import pandas as pd
 import os
 import sys
 import shutil
 import requests
 from functools import wraps
 import json
-import cv2
-import csv
 from werkzeug.utils import secure_filename
-from tensorflow.keras.preprocessing.image import load_img
-
-# ------------For Mailing Service
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail
 
 #-----------For enviroment variables
 from dotenv import load_dotenv
 load_dotenv()
 
 
-#----------For locking and creating Session_ID
-import threading
+#----------For creating Session_ID
 import uuid
 
-# Detectron2
-import torch, detectron2
-from detectron2.config import get_cfg
-from detectron2.engine import DefaultPredictor
-from detectron2.data import MetadataCatalog, DatasetCatalog
-from skimage.measure import label, regionprops
-
-# OCR
-from paddleocr import PaddleOCR
-
-from utils.summary_helper import generate_summary
+from utils.summary_helper import SummaryService
+from utils.summary_input import build_summary_input
+from utils.model_registry import create_registry
+from utils.result_cache import ResultCache
+from utils.batch_classifier import BatchClassifier
+from utils.job_scheduler import JobScheduler, QueueFullError, stream_job
+from utils.job_store import JobStore
+from utils.workspace import Workspace, cleanup_stale_workspaces
+from utils.records import export_debug_tables
+from utils.image_store import ImageStore
+from utils.telemetry import JobTrace, metrics, span
+from utils.uploads import ingest_uploads, UploadError
+from utils.stages import process_map, build_results_table, with_file_name_row, STAGE_NAMES, pipeline_settings, cache_version
+from utils.job_dag import run_per_image
+from utils.notifications import EmailDispatcher, make_transport
 
 # Putting Up the rate limiter
 from flask_limiter import Limiter
@@ -96,52 +88,24 @@ def login_required(func):
 
 #------------------------------------------------------------------------------------------
 
-# RESNET Model
-MODEL_PATH_RESNET = "model/Trained_Models/Colab/resnet50.h5"
-model_resnet = tf.keras.models.load_model(MODEL_PATH_RESNET)
-
-# Annotation detectron2 model
-MODEL_PATH_ANNOTATION = "model/Trained_Models/Colab/annotation/detectron2_annotation.pth"
-cfg1 = get_cfg()
-cfg1.merge_from_file("model/Trained_Models/Colab/annotation/config.yaml")
-cfg1.MODEL.WEIGHTS = MODEL_PATH_ANNOTATION
-cfg1.MODEL.ROI_HEADS.SCORE_THRESH_TEST = 0.5  # confidence threshold
-cfg1.MODEL.DEVICE = "cpu"
-
-annotation_dataset_name = "annotation_dataset_train"
-cfg1.DATASETS.TRAIN = (annotation_dataset_name,)
-
-MetadataCatalog.get(annotation_dataset_name).thing_classes = ["title", "legend"]
-train_metadata_annotation = MetadataCatalog.get(annotation_dataset_name)
-
-model_annotation = DefaultPredictor(cfg1)  # Detectron2 model for the segmentation of the components
-
-# State Segmentation detectron2 model
-MODEL_PATH_STATES = "model/Trained_Models/Colab/detectron2.pth"
-cfg2 = get_cfg()
-cfg2.merge_from_file("model/Trained_Models/Colab/config.yaml")
-cfg2.MODEL.WEIGHTS = MODEL_PATH_STATES
-cfg2.MODEL.ROI_HEADS.SCORE_THRESH_TEST = 0.5  # confidence threshold
-cfg2.MODEL.DEVICE = "cpu"
-
-states_dataset_name = "states_dataset_train"
-cfg2.DATASETS.TRAIN = (states_dataset_name,)
-
-class_names = ["Washington", "Idaho", "Montana", "North Dakota", "South Dakota", "Minnesota", "Iowa", "Wisconsin",
-               "Illinois", "Indiana", "Michigan", "Ohio", "Pennsylvania", "New York", "Vermont", "New Hampshire",
-               "Maine", "Massachusetts", "Rhode Island", "Connecticut", "New Jersey", "Delaware", "Maryland",
-               "West Virginia", "Virginia", "Kentucky", "Tennessee", "North Carolina", "South Carolina", "Georgia",
-               "Alabama", "Mississippi", "Florida", "Louisiana", "Arkansas", "Oklahoma", "Texas", "New Mexico",
-               "Colorado", "Wyoming", "Nebraska", "Utah", "Arizona", "Nevada", "California", "Oregon", "Alaska",
-               "Hawaii", "Kansas", "Missouri"]
-
-MetadataCatalog.get(states_dataset_name).thing_classes = class_names
-train_metadata_states = MetadataCatalog.get(states_dataset_name)
-
-model_states = DefaultPredictor(cfg2)  # Detectron2 model for segmentation of states
-
-# # OCR model
-# ocr_model = PaddleOCR(lang='en')
+# Models: ResNet, both Detectron2 predictors and PaddleOCR are loaded and warmed up once per worker process.
+# MODEL_LOADING=background (default) loads them on a thread so non-inference routes answer right away,
+# "lazy" defers loading to the first job, "eager" blocks startup until everything is ready.
+# "preload" is for gunicorn --preload (see gunicorn.conf.py): the master loads the fork-safe
+# models once and every worker shares them copy-on-write, calling after_fork() for the rest.
+MODEL_LOADING = os.getenv("MODEL_LOADING", "background")
+registry = create_registry()
+if MODEL_LOADING == "eager":
+    registry.load_all()
+elif MODEL_LOADING == "background":
+    registry.start_background_load()
+elif MODEL_LOADING == "preload":
+    registry.preload()
+
+# Jobs share one micro-batching classifier so concurrent uploads go through ResNet together
+RESNET_MAX_BATCH = int(os.getenv("RESNET_MAX_BATCH", "16"))
+RESNET_BATCH_WINDOW_MS = int(os.getenv("RESNET_BATCH_WINDOW_MS", "20"))
+resnet_classifier = BatchClassifier(lambda: registry.get("resnet"), max_batch_size=RESNET_MAX_BATCH, window_ms=RESNET_BATCH_WINDOW_MS)
 
 
 # Folders:
@@ -152,6 +116,8 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 OUTPUT_FOLDER = "outputs"
 app.config["OUTPUT_FOLDER"] = OUTPUT_FOLDER
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+# Per-job workspaces live under OUTPUT_FOLDER; drop ones orphaned by a crash
+cleanup_stale_workspaces(OUTPUT_FOLDER, max_age_seconds=6 * 60 * 60)
 
 RESULTS_FOLDER = "static/results"
 app.config["RESULTS_FOLDER"] = RESULTS_FOLDER
@@ -159,71 +125,8 @@ os.makedirs(RESULTS_FOLDER, exist_ok=True)
 
 FRONTEND_URL = os.getenv("FRONTEND_URL")
 
-# Clear the Folders
-def clear_folder_contents(folder_path):
-    for filename in os.listdir(folder_path):
-        file_path = os.path.join(folder_path, filename)
-        try:
-            if os.path.isfile(file_path):
-                os.unlink(file_path)
-
-            elif os.path.isdir(file_path):
-                shutil.rmtree(file_path)
-        except Exception as e:
-            print(f"Error clearing {file_path}: {e}")
-
-
-# For RESNET:
-def preprocess_image(filepath):
-    img = load_img(filepath, target_size=(224, 224))
-    img = np.asarray(img) / 255
-    img_array = np.expand_dims(img, axis=0)
-    return img_array
-
-
-# For ANNOTATION model->batch processing of the images
-def process_images(input_dir):
-    data = []
-    for image_filename in os.listdir(input_dir):
-        image_path = os.path.join(input_dir, image_filename)
-        new_im = cv2.imread(image_path)
-        outputs = model_annotation(new_im)
-
-        mask = outputs["instances"].pred_masks.to("cpu").numpy().astype(bool)
-        class_labels = outputs["instances"].pred_classes.to("cpu").numpy()
-
-        labeled_mask = label(mask)
-        try:
-            props = regionprops(labeled_mask)
-        except Exception as e:
-            return []
-
-        for i, prop in enumerate(props):
-            bounding_box = tuple(prop.bbox)
-            class_name = train_metadata_annotation.thing_classes[class_labels[i]] if i < len(
-                class_labels) else 'Unknown'
-            data.append((image_filename, class_name, bounding_box))
-    return data
-
-
-def format_bounding_box(bbox):
-    return '' if not bbox else f'({bbox[1]},{bbox[2]},{bbox[4]},{bbox[5]})'
-
-
-def generate_csv(data, output_path):
-    coordinates_dict = {}
-    for filename, class_name, bounding_box in data:
-        if filename not in coordinates_dict:
-            coordinates_dict[filename] = {}
-        coordinates_dict[filename][class_name] = bounding_box
-
-    df = pd.DataFrame({
-        'file name': coordinates_dict.keys(),
-        'legend bounding box': [format_bounding_box(coordinates_dict[f].get('legend', ())) for f in coordinates_dict],
-        'title bounding box': [format_bounding_box(coordinates_dict[f].get('title', ())) for f in coordinates_dict]
-    })
-
-    df.to_csv(output_path, index=False)
+# Set to a folder to keep each job's intermediate stage tables as CSVs (debugging only)
+DEBUG_EXPORT_FOLDER = os.getenv("DEBUG_EXPORT_FOLDER")
 
 
 def delete_path(path):
@@ -242,48 +145,83 @@ def delete_path(path):
         print(f"Path does not exist: {path}")
         return False
 
-def archive_results(session_id):
-    source_dir = OUTPUT_FOLDER
-    target_dir = os.path.join(RESULTS_FOLDER, session_id)
-    source_file = "Color_To_Data_Mapping.csv"  
-    new_filename = "data.csv"
-
-    source_path = os.path.join(source_dir, source_file)
-    target_path = os.path.join(target_dir, new_filename)
-    try:
-        shutil.copy2(source_path, target_path)
-        print(f"Archived to: {target_path}")
-
-    except Exception as e:
-        print(f"Archive failed: {str(e)}")
-
-    source_file = "ai_generated_summary.txt"
-    new_filename = "ai_generated_summary.txt"
+ARCHIVED_FILES = {
+    "Color_To_Data_Mapping.csv": "data.csv",
+    "ai_generated_summary.txt": "ai_generated_summary.txt",
+}
 
-    source_path = os.path.join(source_dir, source_file)
-    target_path = os.path.join(target_dir, new_filename)
-    try:
-        shutil.copy2(source_path, target_path)
-        print(f"Archived to: {target_path}")
-
-    except Exception as e:
-        print(f"Archive failed: {str(e)}")
+def archive_results(session_id, workspace, source_files=tuple(ARCHIVED_FILES)):
+    target_dir = os.path.join(RESULTS_FOLDER, session_id)
+    for source_file in source_files:
+        source_path = workspace.path(source_file)
+        target_path = os.path.join(target_dir, ARCHIVED_FILES[source_file])
+        try:
+            shutil.copy2(source_path, target_path)
+            print(f"Archived to: {target_path}")
 
+        except Exception as e:
+            print(f"Archive failed: {str(e)}")
+
+
+
+# Pipeline job scheduler: PIPELINE_WORKERS jobs run at once, up to PIPELINE_MAX_QUEUE wait behind them
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "2"))
+PIPELINE_MAX_QUEUE = int(os.getenv("PIPELINE_MAX_QUEUE", "20"))
+# Job state and event logs live on disk so any worker process can stream or report a job
+JOB_STORE_DIR = os.getenv("JOB_STORE_DIR", "jobs")
+# Jobs whose owning process stops heartbeating for JOB_STALE_SECONDS (or dies) are reported as failed
+job_store = JobStore(JOB_STORE_DIR, stale_after=float(os.getenv("JOB_STALE_SECONDS", "60")))
+job_store.cleanup(max_age_seconds=int(os.getenv("JOB_RETENTION_HOURS", "6")) * 60 * 60)
+scheduler = JobScheduler(job_store, num_workers=PIPELINE_WORKERS, max_queue_size=PIPELINE_MAX_QUEUE)
+# Image limits, state tiling and color matching, shared with bulk_ingest.py (see utils/stages.py)
+PIPELINE_SETTINGS = pipeline_settings()
+MAX_IMAGE_SIDE = PIPELINE_SETTINGS["max_side"]
+MAX_IMAGE_PIXELS = PIPELINE_SETTINGS["max_pixels"]
+STATES_TILING = PIPELINE_SETTINGS["tiling"]
+COLOR_MATCH_SPACE = PIPELINE_SETTINGS["color_space"]
+
+# Per-image stage results keyed by image content and model versions; RESULT_CACHE_DIR= (empty) disables it
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", "cache")
+result_cache = None
+if RESULT_CACHE_DIR:
+    result_cache = ResultCache(
+        RESULT_CACHE_DIR,
+        version=cache_version(PIPELINE_SETTINGS),
+        memory_items=int(os.getenv("RESULT_CACHE_MEMORY_ITEMS", "256")),
+        max_disk_bytes=int(os.getenv("RESULT_CACHE_DISK_MB", "512")) * 1024 * 1024,
+    )
 
+# LLM summaries run in the background after the results are sent; prompts and summaries are cached
+summary_service = SummaryService(
+    max_workers=int(os.getenv("SUMMARY_WORKERS", "4")),
+    max_items=int(os.getenv("SUMMARY_CACHE_ITEMS", "256")),
+    ttl=int(os.getenv("SUMMARY_CACHE_TTL", str(24 * 60 * 60))),
+)
+# Compact table encoding sent to the LLM: values rounded to significant figures, capped at an estimated token budget
+SUMMARY_SIG_FIGS = int(os.getenv("SUMMARY_SIG_FIGS", "3"))
+SUMMARY_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", "4000"))
+
+# Result emails go through a persistent on-disk queue and a background sender
+notifier = EmailDispatcher(
+    os.getenv("EMAIL_QUEUE_DIR", "email_queue"),
+    make_transport(os.getenv("EMAIL_TRANSPORT", "sendgrid")),
+    max_attempts=int(os.getenv("EMAIL_MAX_ATTEMPTS", "5")),
+    backoff_seconds=float(os.getenv("EMAIL_BACKOFF_SECONDS", "30")),
+    batch_size=int(os.getenv("EMAIL_BATCH_SIZE", "20")),
+)
+if MODEL_LOADING != "preload":
+    notifier.start()   # picks up messages left over from a previous run; forked workers start it in post_fork
 
-uploaded_files = []
-# Global processing lock and session tracker
-processing_lock = threading.Lock()
-active_sessions = {}
+# TRACE_DIR=<folder> writes every job's stage spans to <folder>/<session_id>.json
+TRACE_DIR = os.getenv("TRACE_DIR")
 
+# Threads per job that carry individual images through the stages
+PIPELINE_IMAGE_THREADS = int(os.getenv("PIPELINE_IMAGE_THREADS", "4"))
 
 @app.route("/predict", methods=["POST"])
 @login_required
 @limiter.limit("10 per second")
 def predict():
-    global uploaded_files
-    uploaded_files.clear()
-
     if "files" not in request.files:
         return jsonify({"error": "No files provided"}), 400
 
@@ -294,28 +232,24 @@ def predict():
     files = request.files.getlist("files")
     if not files or all(file.filename == "" for file in files):
         return jsonify({"error": "No files selected"}), 400
+
+    if registry.error:
+        return jsonify({"error": "Models are unavailable, please try again later"}), 503
     
    
 
     # Generate session ID and directories
     session_id = str(uuid.uuid4())
     upload_dir = os.path.join(app.config["UPLOAD_FOLDER"], session_id)
-    os.makedirs(upload_dir, exist_ok=True)
-    
-    # Save files to session directory in UPLOAD_FOLDER
-    for file in files:
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(upload_dir, filename)
-        file.save(filepath)
-
-    # Store uploaded files in the static/results/{session_id} folder
     session_dir = os.path.join(app.config["RESULTS_FOLDER"], session_id)
-    os.makedirs(session_dir, exist_ok=True)
-    for file in files:
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(upload_dir, filename)
-        shutil.copy(filepath, session_dir)
-        uploaded_files.append(filename)
+
+    # Each file is written once into static/results/{session_id} and hard-linked into UPLOAD_FOLDER
+    try:
+        uploaded_files = ingest_uploads([file for file in files if file.filename], session_dir, upload_dir, MAX_IMAGE_PIXELS)
+    except UploadError as e:
+        delete_path(upload_dir)
+        delete_path(session_dir)
+        return jsonify({"error": str(e)}), 400
 
 
 
@@ -329,7 +263,186 @@ def predict():
     #         print(f"User email saved to {email_path}")
     
     print("Files uploaded successfully:", uploaded_files)  # Debugging
-    return jsonify({"message": "Files uploaded successfully", "status": "success", "session_id": session_id}), 200
+
+    # The job starts now and runs in the background; /predict-stream and /jobs/<id> only observe it
+    try:
+        submit_job(session_id, upload_dir, session.get("user", {}).get("email"))
+    except QueueFullError:
+        delete_path(upload_dir)
+        delete_path(session_dir)
+        return jsonify({"error": "Server is busy, please try again in a few minutes"}), 503
+
+    return jsonify({"message": "Files uploaded successfully", "status": "success", "session_id": session_id,
+                    "stream_url": f"/predict-stream?session_id={session_id}",
+                    "status_url": f"/jobs/{session_id}"}), 202
+
+
+def run_pipeline(session_id, upload_dir, user_email):
+    # Runs on a scheduler worker thread; every yielded string is forwarded to the job's SSE stream
+    trace = JobTrace(session_id, TRACE_DIR)
+    outcome = "error"
+    with Workspace(OUTPUT_FOLDER, session_id) as workspace, ImageStore(upload_dir, MAX_IMAGE_SIDE, max_pixels=MAX_IMAGE_PIXELS) as images:
+        try:
+            outcome = yield from process_job(session_id, images, workspace, user_email, trace)
+        finally:
+            trace.finish(outcome)
+            delete_path(upload_dir)
+            sys.stdout.flush()
+
+
+def process_job(session_id, images, workspace, user_email, trace=None):
+    progress_updates = [
+        {"step": 1, "label": "Uploading Images to Server", "status": "completed"},
+        {"step": 2, "label": "Classification of Map Legend Type", "status": "processing"},
+        {"step": 3, "label": "Segmentation of Map Components", "status": "processing"},
+        {"step": 4, "label": "Segmentation of State Boundaries", "status": "processing"},
+        {"step": 5, "label": "Text Data Extraction using OCR", "status": "processing"},
+        {"step": 6, "label": "State Color to Legend Data Mapping", "status": "processing"}
+    ]
+
+    yield f"data: {json.dumps({'progress': progress_updates})}\n\n"
+    yield ""
+
+    # Inference waits here while the models are still loading
+    with span("wait_for_models", trace):
+        registry.wait_until_ready()
+
+    results = []
+    # Every image runs classification -> components -> states -> OCR -> color mapping on its own,
+    # so images overlap across stages; a stage is reported complete once all images are past it
+    models = {
+        "classifier": resnet_classifier,
+        "annotation": registry.get("annotation"),
+        "states": registry.get("states"),
+        "ocr": registry.get("ocr"),
+    }
+    stage_steps = {"classify": 1, "annotate": 2, "segment": 3, "ocr": 4}
+
+    def image_task(filename, report):
+        return process_map(filename, models, images, COLOR_MATCH_SPACE, report, result_cache, STATES_TILING, trace)
+
+    image_results = {}
+    cache_counts = {"hits": 0, "misses": 0}
+    for event, value in run_per_image(images.filenames, image_task, STAGE_NAMES, PIPELINE_IMAGE_THREADS):
+        if event == "results":
+            image_results = value
+        elif event == "event":
+            # Cache outcome per image, so the client can tell which maps were reused
+            cache_counts["hits" if value == "cache_hit" else "misses"] += 1
+            yield f"data: {json.dumps({'progress': progress_updates, 'cache': cache_counts})}\n\n"
+        elif value in stage_steps:
+            step = stage_steps[value]
+            progress_updates[step]["status"] = "completed"
+            progress_updates[step + 1]["status"] = "processing"
+            yield f"data: {json.dumps({'progress': progress_updates})}\n\n"
+            print(f"Stage '{value}' completed for all images.")
+
+    maps = {filename: image_results[filename][0] for filename in images.filenames}
+    found_components = any(image_results[filename][1] for filename in images.filenames)
+
+    if not found_components:
+        print("No regions found in image.")
+        progress_updates = [
+        {"step": 1, "label": "Uploading Images to Server", "status": "completed"},
+        {"step": 2, "label": "Classification of Map Legend Type", "status": "completed"},
+        {"step": 3, "label": "Segmentation of Map Components", "status": "completed"},
+        {"step": 4, "label": "Segmentation of State Boundaries", "status": "completed"},
+        {"step": 5, "label": "Text Data Extraction using OCR", "status": "completed"},
+        {"step": 6, "label": "State Color to Legend Data Mapping", "status": "completed"}
+        ]
+        results = []
+        ai_generated_summary = "No regions found in image."
+        final_data = json.dumps({
+            "Results": results,
+            "Summary": ai_generated_summary,
+            "progress": progress_updates,
+            "status": "fail",
+        })
+        # yield f"data: {json.dumps({'progress': progress_updates})}\n\n"
+        yield f"data: {final_data}\n\n"
+        return "fail"
+
+    else:
+        if DEBUG_EXPORT_FOLDER:
+            export_debug_tables(maps.values(), os.path.join(DEBUG_EXPORT_FOLDER, session_id))
+
+        # ------------------------------------------------------------------------------------------------
+        # Color-to-Data Mapping
+        output_file_path = workspace.path("Color_To_Data_Mapping.csv")
+
+        output_data = [row for filename in images.filenames for row in image_results[filename][2]]
+        with span("results_table", trace, rows=len(output_data)):
+            df, column_files, observed_df = build_results_table(maps, output_data)
+            # The exported table keeps the title -> file mapping as its last row for the frontend
+            export_df = with_file_name_row(df, column_files)
+            export_df.to_csv(output_file_path, index=False)
+
+
+        # Generate Summary in the background; the results go out first. The LLM only sees measured
+        # values, not the medians filled in for missing states
+        summary_future = summary_service.submit(*build_summary_input(observed_df, SUMMARY_SIG_FIGS, token_budget=SUMMARY_TOKEN_BUDGET), trace)
+
+
+        progress_updates[5]["status"] = "completed"
+        yield f"data: {json.dumps({'progress': progress_updates})}\n\n"
+        print("\nColor-to-data mapping completed")
+        # ------------------------------------------------------------------------------------------------
+        # Sending results to the frontend
+        results = export_df.to_dict(orient='records')
+        # print(results)
+
+
+        final_data = json.dumps({
+            "Results": results,
+            "Summary": None,
+            "summary_pending": True,
+            "progress": progress_updates,
+            "status": "success",
+        })
+        # Storing the results in the RESULTS_FOLDER
+        archive_results(session_id, workspace, ["Color_To_Data_Mapping.csv"])
+
+        yield f"data: {final_data}\n\n"
+
+        # Nothing reads the images any more: drop the decoded arrays and the uploads before the job parks
+        images.release()
+        delete_path(images.upload_dir)
+
+        # Frees the pipeline worker until the summary is ready
+        yield summary_future
+        ai_generated_summary = summary_future.result()
+        # Save to file
+        with open(workspace.path("ai_generated_summary.txt"), "w", encoding="utf-8") as file:
+            file.write(ai_generated_summary)
+        archive_results(session_id, workspace, ["ai_generated_summary.txt"])
+
+        yield f"data: {json.dumps({'Summary': ai_generated_summary, 'status': 'summary'})}\n\n"
+
+        view_link = f"{FRONTEND_URL}/?session_id={session_id}"
+        # Get user email from session data
+        if final_data and user_email:
+            user_email = user_email.strip()
+            print("USER EMAIL: ",user_email)
+            notifier.enqueue(user_email, 'Choropleth Analysis Complete', f"""
+                <h1>Analysis Complete</h1>
+                <p>Your choropleth map analysis is ready:</p>
+                <a href="{view_link}" style="
+                    background: #00c3ff;
+                    color: white;
+                    padding: 10px 20px;
+                    text-decoration: none;
+                    border-radius: 5px;
+                    display: inline-block;
+                    margin-top: 15px;
+                ">View Results</a>
+                """)
+        return "success"
+
+
+
+def submit_job(session_id, upload_dir, user_email):
+    # Returns False when the session's job was already submitted, possibly by another worker process
+    return scheduler.submit(session_id, run_pipeline, session_id, upload_dir, user_email)
 
 
 @app.route("/predict-stream", methods=["GET"])
@@ -346,471 +459,73 @@ def predict_stream():
         upload_dir = os.path.join(app.config["UPLOAD_FOLDER"], session_id)
         # email_dir = os.path.join(app.config["EMAIL_FOLDER"], session_id)
         
-        if not os.path.exists(upload_dir):
+        if job_store.state(session_id) is None and not os.path.exists(upload_dir):
             return jsonify({"error": "Invalid session ID"}), 404
 
     except Exception as e:
         return jsonify({"error": f"Validation error: {str(e)}"}), 500
-    
-    def generate_progress():
-        with processing_lock:
-
-            clear_folder_contents(OUTPUT_FOLDER)
-            progress_updates = [
-                {"step": 1, "label": "Uploading Images to Server", "status": "completed"},
-                {"step": 2, "label": "Classification of Map Legend Type", "status": "processing"},
-                {"step": 3, "label": "Segmentation of Map Components", "status": "processing"},
-                {"step": 4, "label": "Segmentation of State Boundaries", "status": "processing"},
-                {"step": 5, "label": "Text Data Extraction using OCR", "status": "processing"},
-                {"step": 6, "label": "State Color to Legend Data Mapping", "status": "processing"}
-            ]
-
-            yield f"data: {json.dumps({'progress': progress_updates})}\n\n"
-            yield ""
-
-            results = []
-            global final_results_ready
-            # RESNET MODEL BATCH PROCESSING
-            csv_file = os.path.join(OUTPUT_FOLDER, "classification.csv")
-            with open(csv_file, mode='w', newline='') as file:
-                writer = csv.writer(file)
-                writer.writerow(["file name", "Type"])
-
-                for filename in os.listdir(upload_dir):
-                    if filename.endswith(('.png', '.jpg', '.jpeg')):
-                        path = os.path.join(upload_dir, filename)
-                        img = preprocess_image(path)
-                        prediction_resnet = model_resnet.predict(img)
-                        print(f"Prediction for {filename}: {prediction_resnet[0][0]}")
-                        img_type = "continuous" if prediction_resnet[0][0] > 0.5 else "discrete"
-                        writer.writerow([filename, img_type])
-
-            progress_updates[1]["status"] = "completed"
-            progress_updates[2]["status"] = "processing"
-            yield f"data: {json.dumps({'progress': progress_updates})}\n\n"
-            print(f"\nPredictions saved to {csv_file}")
-            # -----------------------------------------------------------------------------------------------
-
-            # ANNOTATION DETECTRON2 MODEL BATCH PROCESSING
-            output_csv_path = os.path.join(OUTPUT_FOLDER, "output_objects.csv")
-            data_annotation = process_images(upload_dir)
-
-            if(data_annotation==[]):
-                print("No regions found in image.")
-                progress_updates = [
-                {"step": 1, "label": "Uploading Images to Server", "status": "completed"},
-                {"step": 2, "label": "Classification of Map Legend Type", "status": "completed"},
-                {"step": 3, "label": "Segmentation of Map Components", "status": "completed"},
-                {"step": 4, "label": "Segmentation of State Boundaries", "status": "completed"},
-                {"step": 5, "label": "Text Data Extraction using OCR", "status": "completed"},
-                {"step": 6, "label": "State Color to Legend Data Mapping", "status": "completed"}
-                ]
-                results = []
-                ai_generated_summary = "No regions found in image."
-                final_data = json.dumps({
-                    "Results": results,
-                    "Summary": ai_generated_summary,
-                    "progress": progress_updates,
-                    "status": "fail",
-                })
-                # yield f"data: {json.dumps({'progress': progress_updates})}\n\n"
-                yield f"data: {final_data}\n\n"
-            
-            else:
-                generate_csv(data_annotation, output_csv_path)
-                progress_updates[2]["status"] = "completed"
-                progress_updates[3]["status"] = "processing"
-                yield f"data: {json.dumps({'progress': progress_updates})}\n\n"
-                print("Processed output saved to CSV.")
-                # -----------------------------------------------------------------------------------------------
-                # DETECTRON2 FOR SEGMENTATION OF STATES
-                output_csv_path = os.path.join(OUTPUT_FOLDER, "output_objects_state_segmentation.csv")
-
-                with open(output_csv_path, 'w', newline='') as csvfile:
-                    csvwriter = csv.writer(csvfile)
-                    csvwriter.writerow(["File Name", "Class Name", "Object Number", "Centroid", "BoundingBox", "RGB Color"])
-
-                    for image_filename in os.listdir(upload_dir):
-                        image_path = os.path.join(upload_dir, image_filename)
-                        new_im = cv2.imread(image_path)
-
-                        outputs = model_states(new_im)
-
-                        mask = outputs["instances"].pred_masks.to("cpu").numpy().astype(bool)
-                        class_labels = outputs["instances"].pred_classes.to("cpu").numpy()
-                        labeled_mask = label(mask)
-                        props = regionprops(labeled_mask)
-
-                        for i, prop in enumerate(props):
-                            object_number = i + 1
-                            centroid = prop.centroid
-                            bounding_box = prop.bbox[1:3] + prop.bbox[4:]
-
-                            n = int(centroid[0])
-
-                            if i < len(class_labels):
-                                class_label = class_labels[n]
-                                class_name = train_metadata_states.thing_classes[class_label]
-                            else:
-                                class_name = 'Unknown'
-
-                            # Extract RGB color value from the centroid position
-                            centroid_x, centroid_y = int(centroid[2]), int(centroid[1])
-                            rgb_color = tuple(new_im[centroid_y, centroid_x])[::-1]
-
-                            csvwriter.writerow([image_filename, class_name, object_number, centroid, bounding_box, rgb_color])
-
-                progress_updates[3]["status"] = "completed"
-                progress_updates[4]["status"] = "processing"
-                yield f"data: {json.dumps({'progress': progress_updates})}\n\n"
-                print("\nObject-level information saved to CSV file.")
-                print("\nSegmentation of all images completed.")
-                # -----------------------------------------------------------------------------------------------
-                # OCR MODEL FOR TEXT EXTRACTION
-                # OCR model
-                ocr_model = PaddleOCR(lang='en')
-
-                df1 = pd.read_csv("outputs/classification.csv")
-                df2 = pd.read_csv("outputs/output_objects.csv")
-                annotations_df = pd.merge(df2, df1, on="file name")
-                img_path = "uploads"
-                data = []
-                for row in annotations_df.itertuples():
-                    file_name = row[1]
-                    map_type = row[4]
-                    title_bounding_box = row[3]
-                    legend_bounding_box = row[2]
-                    data.append((file_name, map_type, title_bounding_box, legend_bounding_box))
-
-                def convert_to_doubles(low, upper_bound):
-                    low = lower_bound.replace(",", "")
-                    up = upper_bound.replace(",", "")
-
-                    if low and not low[-1].isdigit():
-                        units = low[-1]
-                        low = float(low[:-1])
-                    else:
-                        units = 'u'
-                        low = float(low)
-
-                    if up and not up[-1].isdigit():
-                        units = up[-1]
-                        up = float(up[:-1])
-                    else:
-                        units = 'u'
-                        up = float(up)
-
-                    return low, up, units
-
-                def num_there(s):
-                    return any(i.isdigit() for i in s)
-
-                def only_num(s):
-                    return s.isnumeric()
-
-                def contains_hyphen(text_):
-                    return '-' in text_
-
-                def extract_numbers(test_string):
-                    numeric_string = ''.join(char for char in test_string if char.isdigit() or char == ',')
-                    words = numeric_string.split(',')
-                    numbers = [int(i) for i in words]
-                    return numbers
-
-                complete_data = []
-
-                for ele in data:
-                    file_name = ele[0]
-
-                    map_type = ele[1]
-                    title_bounding_box = ele[2]
-                    legend_bounding_box = ele[3]
-
-                    values = extract_numbers(title_bounding_box)
-
-                    imgPath = os.path.join(upload_dir, file_name)
-                    image = cv2.imread(imgPath)
-
-                    y, x, h, w = values
-
-                    cropped_img = image[y:y + h, x:x + w]
-                    numpydata = asarray(cropped_img)
-
-                    result = ocr_model.ocr(numpydata, cls=False)
-                    map_title = result[0][0][1][0]
-
-                    numerical_info = []
-                    values = extract_numbers(legend_bounding_box)
-                    y, x, h, w = values
-
-                    cropped_img = image[y:y + h, x:x + w]
-                    numpydata = asarray(cropped_img)
-                    image = cropped_img
-
-                    result = ocr_model.ocr(numpydata, cls=False)
-
-                    for line in result:
-                        for word in line:
-                            text = word[1][0]
-
-                            x, y, w, h = word[0][0][0], word[0][0][1], abs(word[0][0][0] - word[0][1][0]), abs(
-                                word[0][1][1] - word[0][2][1])
-
-                            x1 = int(x)
-                            y1 = int(y + h // 2)
-                            x2 = int(x)
-                            y2 = int(y + h // 2 - 1)
-
-                            while all(image[y1, x1] == image[y2, x2]):
-                                x2 -= 1
-                            x3 = x2
-                            while all(image[y1, x1] == image[y2, x3]):
-                                x3 -= 1
-
-                            x2 = (x2 + x3) // 2
-                            color = image[y2, x2]
-
-                            blue, green, red = color
-                            numerical_info += [text] + [red, green, blue]
-
-                    i = 0
-                    value_id = 0
-                    while i < len(numerical_info):
-                        value_id += 1
-
-                        if numerical_info[i] != "N/A" and numerical_info[i] != "-" and any(
-                                char.isdigit() for char in numerical_info[i]):  # modified code from original
-                            values = numerical_info[i].split("-")
-
-                            if len(values) > 1:
-                                lower_bound = values[0]
-                                upper_bound = values[1]
-                            else:
-                                lower_bound = values[0]
-                                upper_bound = values[0]
-                            converted_lower_bound, converted_upper_bound, units = convert_to_doubles(lower_bound, upper_bound)
-                            info = [file_name, map_type, map_title, numerical_info[i + 1], numerical_info[i + 2],
-                                    numerical_info[i + 3], (converted_lower_bound + converted_upper_bound) / 2, units]
-
-                        else:
-                            values = "N/A"
-                            info = [file_name, map_type, map_title, numerical_info[i + 1], numerical_info[i + 2],
-                                    numerical_info[i + 3], values, ""]
-
-                        map_name = img_path.split("/")[-1].split(".")[0]
-                        info = [map_name] + info
-                        complete_data += [info]
-                        i += 4
-
-                output_df = pd.DataFrame(complete_data)
-                df = output_df[output_df[7] != 'N/A']
-
-                combined_column = df.apply(lambda row: f"({row[4]}, {row[5]}, {row[6]})", axis=1)
-                df['RGB color'] = combined_column
-                df.drop([4, 5, 6], axis=1, inplace=True)
-                df.drop([0], axis=1, inplace=True)
-                new_column_names = {
-                    1: 'file_name',
-                    2: 'map_type',
-                    3: 'map_title',
-                    7: 'value',
-                    8: 'unit'
-                }
-                df = df.rename(columns=new_column_names)
-                df.to_csv("outputs/OCR_output.csv", index=False)
-
-                progress_updates[4]["status"] = "completed"
-                progress_updates[5]["status"] = "processing"
-                yield f"data: {json.dumps({'progress': progress_updates})}\n\n"
-                print("OCR output is saved.")
-                # ------------------------------------------------------------------------------------------------
-                # Color-to-Data Mapping
-                ocr_df = pd.read_csv("outputs/OCR_output.csv")
-                seg_df = pd.read_csv("outputs/output_objects_state_segmentation.csv")
-                output_file_path = "outputs/Color_To_Data_Mapping.csv"
-
-                def getDataForFilename(output_data, filename):
-                    return [tuple for tuple in output_data if tuple[0] == filename]
-
-                def getUniqueFilenames(ocr_df):
-                    return ocr_df['file_name'].unique().tolist()
-
-                def getMapTitleDictionary(ocr_df, filenames_list):
-                    map_dict = {}
-                    for filename in filenames_list:
-                        filtered_rows = ocr_df[ocr_df['file_name'] == filename]
-                        row = filtered_rows.iloc[0]
-                        map_dict[filename] = row['map_title']
-
-                    return map_dict
-
-                data_a = []
-                data_b = []
-
-                for row in seg_df.itertuples():
-                    file_name = row[1]
-                    state = row[2]
-                    color_str = row[6]
-                    color = tuple(int(x) for x in color_str.strip('()').split(', '))
-                    data_a.append((file_name, state, color))
-
-                for row in ocr_df.itertuples():
-                    file_name = row[1]
-                    map_type = row[2]
-                    map_title = row[3]
-                    color_str = row[6]
-                    color = tuple(int(x) for x in color_str.strip('()').split(', '))
-                    value = row[4]
-                    if value != "'N/A'":
-                        average_value = float(value)
-                    else:
-                        average_value = 0
-                    unit = row[5]
-                    data_b.append((file_name, map_type, map_title, average_value, unit, color))
-
-                output_data = []
-                for file_name, state, state_color in data_a:
-                    numerical_data = []
-                    for file, map_type, map_title, average_value, unit, color in data_b:
-                        if file_name == file:
-                            numerical_data.append((map_title, map_type, color, average_value, unit))
-                    if numerical_data:
-                        mapType = numerical_data[0][1]
-                        if mapType == "discrete":
-                            min_distance = float('inf')
-                            assigned_value = None
-                            assigned_unit = None
-                            for map_title, map_type, color, average_value, unit in numerical_data:
-                                # calculating Euclidean distance
-                                distance = sum((c1 - c2) ** 2 for c1, c2 in zip(state_color, color))
-                                if distance < min_distance:
-                                    min_distance = distance
-                                    assigned_value = average_value
-                                    assigned_unit = unit
-                            output_data.append((file_name, state, assigned_value, assigned_unit))
-                        elif mapType == "continuous":
-                            assigned_value = 0
-                            assigned_unit = numerical_data[0][4]
-                            for i in range(len(numerical_data) - 1):
-                                delta = 0
-                                if i == 0:
-                                    delta = 1
-                                elif i == len(numerical_data) - 2:
-                                    delta = -0.5
-
-                                colour_1, value_1 = numerical_data[i][2], numerical_data[i][3]
-                                colour_2, value_2 = numerical_data[i + 1][2], numerical_data[i + 1][3]
-
-                                A = []
-                                for sc, c1, c2 in zip(state_color, colour_1, colour_2):
-                                    if c1 == c2:
-                                        A.append(0)
-                                    else:
-                                        A.append((sc - c2) / (c1 - c2))
-
-                                non_zero_A = [a for a in A if a != 0]
-                                if non_zero_A:
-                                    A = sum(non_zero_A) / len(non_zero_A)
-                                else:
-                                    A = 0
-
-                                if (0 + delta) <= A and A <= (1 + delta):
-                                    assigned_value = A * (value_1 - value_2) + value_2
-                            output_data.append((file_name, state, assigned_value, assigned_unit))
-
-                file_list = getUniqueFilenames(ocr_df)
-                map_titles = getMapTitleDictionary(ocr_df, file_list)
-
-                df = pd.DataFrame(columns=['State_Name'])
-                df['State_Name'] = list({state for _, state, _, _ in output_data})
-
-                title_to_filename_mapping = {'State_Name': 'File_Name'}
-
-                for filename in file_list:
-                    dataReqd = getDataForFilename(output_data, filename)
-                    # map_title = map_titles[filename]
-                    map_title = f"{map_titles[filename]} ({dataReqd[0][3]})"
-                    df[map_title] = 0.0
-
-                    for filename, state, assigned_value, assigned_unit in dataReqd:
-                        df.loc[df['State_Name'] == state, map_title] = assigned_value
-                        title_to_filename_mapping[map_title] = filename
-
-                df = df.drop_duplicates()
-                for col in df.columns[1:]:
-                    median_val = df[col].replace(0, pd.NA).median()
-                    df[col] = df[col].replace(0, median_val)
-
-                df = df._append(title_to_filename_mapping, ignore_index=True)
-                df.to_csv(output_file_path, index=False)
-
-
-                # Generate Summary
-                ai_generated_summary = generate_summary(','.join(df.columns[1:]), df.to_csv(index=False, lineterminator='\n'))
-                # Save to file
-                with open(f"{OUTPUT_FOLDER}/ai_generated_summary.txt", "w", encoding="utf-8") as file:
-                    file.write(ai_generated_summary)
-
-
-                progress_updates[5]["status"] = "completed"
-                yield f"data: {json.dumps({'progress': progress_updates})}\n\n"
-                print("\nColor-to-data mapping completed")
-                # ------------------------------------------------------------------------------------------------
-                # Sending results to the frontend
-                results = df.to_dict(orient='records')
-                # print(results)
-
-
-                final_data = json.dumps({
-                    "Results": results,
-                    "Summary": ai_generated_summary,
-                    "progress": progress_updates,
-                    "status": "success",
-                })
-                # Storing the results in the RESULTS_FOLDER
-                archive_results(session_id)
-
-                yield f"data: {final_data}\n\n"
-
-                view_link = f"{FRONTEND_URL}/?session_id={session_id}"
-                # Get user email from session data
-                if final_data:
-                    user_email = session["user"]["email"]
-                    user_email = user_email.strip()
-                    print("USER EMAIL: ",user_email)
-                    message = Mail(
-                        from_email=os.getenv('MAIL_DEFAULT_SENDER'),
-                        to_emails=user_email,
-                        subject='Choropleth Analysis Complete',
-                        html_content=f"""
-                        <h1>Analysis Complete</h1>
-                        <p>Your choropleth map analysis is ready:</p>
-                        <a href="{view_link}" style="
-                            background: #00c3ff;
-                            color: white;
-                            padding: 10px 20px;
-                            text-decoration: none;
-                            border-radius: 5px;
-                            display: inline-block;
-                            margin-top: 15px;
-                        ">View Results</a>
-                        """)
-                    try:
-                        sg = SendGridAPIClient(os.environ.get('SENDGRID_API_KEY'))
-                        response = sg.send(message)
-                        print(response.status_code)
-                        print(response.body)
-                        print(response.headers)
-                    except Exception as e:
-                        print(e.message)
-                
-                
-            
 
-            delete_path(upload_dir)
-            sys.stdout.flush()
+    # Uploads normally start their job; this covers clients that only open the stream
+    if job_store.state(session_id) is None:
+        if registry.error:
+            return jsonify({"error": "Models are unavailable, please try again later"}), 503
+        try:
+            submit_job(session_id, upload_dir, session.get("user", {}).get("email"))
+        except QueueFullError:
+            return jsonify({"error": "Server is busy, please try again in a few minutes"}), 503
 
-    return Response(stream_with_context(generate_progress()), mimetype="text/event-stream")
+    # Browsers resend the last id they saw when reconnecting, so the stream resumes there
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id") or "0"
+    try:
+        last_event_id = int(last_event_id)
+    except ValueError:
+        return jsonify({"error": "Invalid Last-Event-ID"}), 400
+
+    return Response(stream_with_context(stream_job(job_store, session_id, last_event_id)), mimetype="text/event-stream")
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    # Polling alternative to /predict-stream: job state plus the latest progress / results
+    snapshot = job_store.snapshot(secure_filename(job_id))
+    if snapshot is None:
+        return jsonify({"error": "Invalid session ID"}), 404
+    return jsonify(snapshot), 200
+
+
+
+
+@app.route("/health")
+def health():
+    status = registry.status()
+    return jsonify(status), (200 if status["ready"] else 503)
+
+
+@app.route("/metrics")
+def prometheus_metrics():
+    # Stage latency / CPU / memory histograms of all workers (with METRICS_DIR), plus the queue
+    # and model state of the worker answering, labelled with its pid
+    stats = scheduler.stats()
+    worker = f'{{worker="{os.getpid()}"}}'
+    lines = [
+        "# TYPE cma_jobs_queued gauge", f"cma_jobs_queued{worker} {stats['queued']}",
+        "# TYPE cma_jobs_running gauge", f"cma_jobs_running{worker} {stats['running']}",
+        "# TYPE cma_jobs_waiting gauge", f"cma_jobs_waiting{worker} {stats['waiting']}",
+        "# TYPE cma_models_ready gauge", f"cma_models_ready{worker} {int(registry.ready)}",
+    ]
+    return Response(metrics.render() + "\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/pipeline/stats")
+def pipeline_stats():
+    return jsonify({
+        "scheduler": scheduler.stats(),
+        "cache": result_cache.stats() if result_cache else None,
+        "email": notifier.stats(),
+        "resnet": resnet_classifier.stats(),
+        "annotation": registry.get("annotation").stats() if registry.ready else None,
+        "states": registry.get("states").stats() if registry.ready else None,
+    })
 
 
 # @app.route('/download', methods=['GET'])
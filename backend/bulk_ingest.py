@@ -0,0 +1,276 @@
+"""
+Bulk offline ingestion: runs every map of a directory or manifest through the
+same stages as the web pipeline (utils.stages.process_map) on a process pool,
+writing one row per state to a CSV / JSONL / Parquet sink as each map finishes.
+
+    python bulk_ingest.py /data/maps --output results.jsonl
+    python bulk_ingest.py manifest.txt --output results.csv --workers 4
+
+Finished maps are recorded in <output>.checkpoint, so running the same command
+again after an interruption resumes where it stopped. Maps that fail are
+logged to <output>.errors.jsonl and retried on the next run.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+# One map at a time per process: nothing to gain from waiting for other images to batch with
+os.environ.setdefault("DETECTRON2_BATCH_WINDOW_MS", "0")
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import multiprocessing
+
+from utils.image_store import IMAGE_EXTENSIONS
+
+
+FIELDS = ["source", "file_name", "map_title", "map_type", "state", "value", "unit"]
+
+
+def find_images(source):
+    """A directory (searched recursively) or a manifest with one image path per line."""
+    if os.path.isdir(source):
+        paths = []
+        for root, _, files in os.walk(source):
+            paths += [os.path.join(root, f) for f in files if f.lower().endswith(IMAGE_EXTENSIONS)]
+        return sorted(paths)
+
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, encoding="utf-8") as manifest:
+        lines = [line.strip() for line in manifest]
+    return [line if os.path.isabs(line) else os.path.join(base, line)
+            for line in lines if line and not line.startswith("#")]
+
+
+class CSVSink:
+    def __init__(self, path):
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, "a", newline="", encoding="utf-8")
+        self.writer = csv.DictWriter(self.file, fieldnames=FIELDS)
+        if new_file:
+            self.writer.writeheader()
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def flush(self):
+        self.file.flush()
+        return True
+
+    def close(self):
+        self.file.close()
+
+
+class JSONLSink:
+    def __init__(self, path):
+        self.file = open(path, "a", encoding="utf-8")
+
+    def write(self, rows):
+        for row in rows:
+            self.file.write(json.dumps(row) + "\n")
+
+    def flush(self):
+        self.file.flush()
+        return True
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetSink:
+    # Parquet files cannot be appended to, so rows go out as numbered part files in a directory
+    def __init__(self, path, rows_per_part=10000):
+        import pyarrow  # noqa: F401 - fail early when the optional dependency is missing
+
+        self.path = path
+        self.rows_per_part = rows_per_part
+        self.rows = []
+        os.makedirs(path, exist_ok=True)
+        self.part = len([f for f in os.listdir(path) if f.endswith(".parquet")])
+
+    def write(self, rows):
+        self.rows += rows
+
+    def flush(self, force=False):
+        """Writes a part once enough rows are buffered; True when everything written so far is on disk."""
+        if not self.rows or (len(self.rows) < self.rows_per_part and not force):
+            return not self.rows
+        import pandas as pd
+
+        pd.DataFrame(self.rows, columns=FIELDS).to_parquet(os.path.join(self.path, f"part-{self.part:05d}.parquet"), index=False)
+        self.part += 1
+        self.rows = []
+        return True
+
+    def close(self):
+        self.flush(force=True)
+
+
+SINKS = {"csv": CSVSink, "jsonl": JSONLSink, "parquet": ParquetSink}
+
+
+class Checkpoint:
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as file:
+                self.done = {line.rstrip("\n") for line in file if line.endswith("\n")}
+        self.file = open(path, "a", encoding="utf-8")
+
+    def add(self, paths):
+        for path in paths:
+            self.file.write(path + "\n")
+            self.done.add(path)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+# ------------------------------------------------------------------------------------------
+# Worker processes: every one loads the models once and then handles one map at a time
+
+_models = None
+_settings = None
+_init_error = None
+
+
+def init_worker(settings):
+    # An exception here would make the pool respawn workers forever; it is reported by process_image instead
+    global _init_error
+    try:
+        _load_worker(settings)
+    except Exception as e:
+        _init_error = f"{type(e).__name__}: {e}"
+
+
+def _load_worker(settings):
+    global _models, _settings
+    from utils.model_registry import create_registry
+    from utils.batch_classifier import BatchClassifier
+    from utils.result_cache import ResultCache
+
+    registry = create_registry()
+    registry.load_all()
+    _models = {
+        "classifier": BatchClassifier(lambda: registry.get("resnet"), max_batch_size=1, window_ms=0),
+        "annotation": registry.get("annotation"),
+        "states": registry.get("states"),
+        "ocr": registry.get("ocr"),
+    }
+    _settings = dict(settings)
+    if settings["cache_dir"]:
+        _settings["cache"] = ResultCache(settings["cache_dir"], version=settings["cache_version"])
+
+
+def process_image(path):
+    """(path, rows, error, fatal): fatal when this worker could not load the models."""
+    from utils.image_store import ImageStore
+    from utils.stages import process_map
+
+    if _init_error is not None:
+        return path, None, _init_error, True
+    try:
+        directory, filename = os.path.split(path)
+        with ImageStore(directory, _settings["max_side"], filenames=[filename],
+                        max_pixels=_settings["max_pixels"]) as images:
+            map_result, _, output_data = process_map(filename, _models, images, _settings["color_space"],
+                                                     cache=_settings.get("cache"), tiling=_settings["tiling"])
+    except Exception as e:
+        return path, None, str(e), False
+
+    rows = [{"source": path, "file_name": file_name, "map_title": map_result.map_title, "map_type": map_result.map_type,
+             "state": state, "value": value, "unit": unit}
+            for file_name, state, value, unit in output_data]
+    return path, rows, None, False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract state data from many choropleth maps.")
+    parser.add_argument("source", help="directory of map images, or a manifest file with one path per line")
+    parser.add_argument("--output", required=True, help="output file (csv / jsonl) or directory (parquet)")
+    parser.add_argument("--format", choices=sorted(SINKS), help="defaults to the output file extension")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="processes, each holding its own copy of the models (default: all cores)")
+    parser.add_argument("--cache-dir", default=os.getenv("RESULT_CACHE_DIR", ""),
+                        help="per-image result cache shared with the web app (default: RESULT_CACHE_DIR)")
+    args = parser.parse_args(argv)
+
+    from utils.model_registry import (MODEL_PATH_RESNET, MODEL_PATH_ANNOTATION, CONFIG_PATH_ANNOTATION,
+                                      MODEL_PATH_STATES, CONFIG_PATH_STATES)
+    from utils.stages import pipeline_settings, cache_version
+
+    output_format = args.format or os.path.splitext(args.output)[1].lstrip(".").lower()
+    if output_format not in SINKS:
+        parser.error("could not infer --format from the output name")
+
+    missing = [path for path in (MODEL_PATH_RESNET, MODEL_PATH_ANNOTATION, CONFIG_PATH_ANNOTATION,
+                                 MODEL_PATH_STATES, CONFIG_PATH_STATES) if not os.path.exists(path)]
+    if missing:
+        print(f"Model files not found: {', '.join(missing)}")
+        return 2
+
+    # Same settings as the web app, so bulk results match interactive ones and share the result cache
+    settings = pipeline_settings()
+    settings.update(cache_dir=args.cache_dir, cache_version=cache_version(settings))
+
+    # Split the cores between the worker processes instead of every torch pool using all of them
+    workers = max(1, args.workers)
+    os.environ.setdefault("TORCH_NUM_THREADS", str(max(1, (os.cpu_count() or 1) // workers)))
+
+    checkpoint = Checkpoint(f"{args.output}.checkpoint")
+    paths = [path for path in find_images(args.source) if path not in checkpoint.done]
+    print(f"{len(checkpoint.done)} maps already done, {len(paths)} to go with {workers} workers")
+    if not paths:
+        return 0
+
+    sink = SINKS[output_format](args.output)
+    errors = open(f"{args.output}.errors.jsonl", "a", encoding="utf-8")
+    pending = []
+    failed = 0
+    fatal_error = None
+    started = time.perf_counter()
+    # TensorFlow, torch and Paddle are not fork-safe once initialised, so workers start fresh
+    context = multiprocessing.get_context("spawn")
+    try:
+        with context.Pool(workers, initializer=init_worker, initargs=(settings,)) as pool:
+            for count, (path, rows, error, fatal) in enumerate(pool.imap_unordered(process_image, paths), start=1):
+                if fatal:
+                    # The map itself was never tried, so it is neither done nor logged as failed
+                    fatal_error = error
+                    pool.terminate()
+                    break
+                if error is not None:
+                    failed += 1
+                    errors.write(json.dumps({"source": path, "error": error, "time": time.time()}) + "\n")
+                    errors.flush()
+                else:
+                    sink.write(rows)
+                    pending.append(path)
+                # A map counts as done only once its rows are on disk
+                if pending and sink.flush():
+                    checkpoint.add(pending)
+                    pending = []
+                if count % 50 == 0 or count == len(paths):
+                    rate = count / (time.perf_counter() - started)
+                    print(f"{count}/{len(paths)} maps, {failed} failed, {rate:.2f} maps/s")
+                    sys.stdout.flush()
+    finally:
+        sink.close()
+        checkpoint.add(pending)
+        checkpoint.close()
+        errors.close()
+    if fatal_error is not None:
+        print(f"A worker could not load the models, stopping: {fatal_error}")
+        return 2
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,41 @@
+# Gunicorn settings for the CMA backend: gunicorn -c gunicorn.conf.py app:app
+import gc
+import glob
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("GUNICORN_WORKERS", "4"))
+
+# Threaded workers: an open /predict-stream connection occupies one thread for as long as
+# its job runs, not the whole worker, and the worker's heartbeat keeps going meanwhile,
+# so long streams never trip the timeout and kill the pipeline jobs running in that worker
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "16"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+
+# MODEL_LOADING=preload imports app.py once in the master so the Detectron2 weights
+# are loaded a single time and shared copy-on-write by all workers
+preload_app = os.getenv("MODEL_LOADING") == "preload"
+
+# Workers write their metrics to METRICS_DIR so /metrics reports the sum over all of them.
+# Set here so the environment reaches the app in every worker; start each run from an empty directory
+os.environ.setdefault("METRICS_DIR", "metrics")
+
+
+def on_starting(server):
+    for path in glob.glob(os.path.join(os.environ["METRICS_DIR"], "*.json")):
+        os.remove(path)
+
+
+def pre_fork(server, worker):
+    # Keep the preloaded objects out of the garbage collector's reach so that
+    # collections in the workers don't write to (and un-share) their pages
+    if preload_app:
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    if preload_app:
+        from app import registry, notifier
+        registry.after_fork()
+        notifier.start()
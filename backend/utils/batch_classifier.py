@@ -0,0 +1,27 @@
+import numpy as np
+
+from utils.micro_batcher import MicroBatcher
+
+
+class BatchClassifier(MicroBatcher):
+    """
+    Micro-batching front end for the ResNet legend-type classifier.
+    Callers from any job hand in their preprocessed images; requests arriving
+    within window_ms of each other are stacked into one tensor and classified in
+    a single forward pass of at most max_batch_size images.
+    """
+
+    name = "resnet-batcher"
+
+    def __init__(self, get_model, max_batch_size=16, window_ms=20):
+        super().__init__(max_batch_size=max_batch_size, window_ms=window_ms)
+        # get_model is called from the batching thread, so the model may still be loading here
+        self.get_model = get_model
+
+    def classify(self, images):
+        """images: list of (224, 224, 3) arrays scaled to [0, 1]. Returns one score per image."""
+        return self.submit(images)
+
+    def forward(self, images):
+        predictions = self.get_model().predict_on_batch(np.stack(images))
+        return [float(p) for p in np.asarray(predictions)[:, 0]]
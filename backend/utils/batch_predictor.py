@@ -0,0 +1,57 @@
+import os
+
+import torch
+
+from utils.micro_batcher import MicroBatcher
+
+
+def configure_torch_threads():
+    # TORCH_NUM_THREADS caps intra-op threads per process; with several gunicorn
+    # workers or pipeline workers on one box, fewer threads each usually wins
+    threads = os.getenv("TORCH_NUM_THREADS")
+    if not threads:
+        return
+    try:
+        torch.set_num_threads(int(threads))
+    except ValueError:
+        print(f"Ignoring TORCH_NUM_THREADS={threads!r}: not an integer")
+
+
+class BatchPredictor(MicroBatcher):
+    """
+    Batched replacement for calling a Detectron2 DefaultPredictor once per image.
+    Images are preprocessed exactly like DefaultPredictor does (resize augmentation,
+    channel order) on the caller's thread, then images from every job arriving
+    within window_ms are sorted by resized shape, so each forward pass pads as
+    little as possible, and fed to the model as lists of at most max_batch_size.
+    """
+
+    def __init__(self, predictor, max_batch_size=4, window_ms=20, name="detectron2-batcher"):
+        super().__init__(max_batch_size=max_batch_size, window_ms=window_ms)
+        self.name = name
+        self.model = predictor.model
+        self.aug = predictor.aug
+        self.input_format = predictor.input_format
+
+    def __call__(self, image):
+        # Same call signature as DefaultPredictor for single images
+        return self.predict([image])[0]
+
+    def predict(self, images):
+        """images: list of BGR arrays. Returns one {"instances": ...} dict per image."""
+        return self.submit([self.prepare(image) for image in images])
+
+    def prepare(self, original_image):
+        if self.input_format == "RGB":
+            original_image = original_image[:, :, ::-1]
+        height, width = original_image.shape[:2]
+        image = self.aug.get_transform(original_image).apply_image(original_image)
+        image = torch.as_tensor(image.astype("float32").transpose(2, 0, 1))
+        return {"image": image, "height": height, "width": width}
+
+    def batch_order(self, inputs):
+        return sorted(range(len(inputs)), key=lambda i: tuple(inputs[i]["image"].shape[1:]))
+
+    def forward(self, inputs):
+        with torch.no_grad():
+            return self.model(inputs)
@@ -0,0 +1,88 @@
+import cv2
+import numpy as np
+
+
+def to_color_space(colors, color_space="rgb"):
+    """(N, 3) RGB ints -> float array in the requested space ("rgb" or "lab" for CIELAB)."""
+    colors = np.asarray(colors, dtype=np.float32).reshape(-1, 3)
+    if color_space == "lab":
+        # float input in [0, 1] gives L in [0, 100] and a/b in about [-127, 127]
+        return cv2.cvtColor((colors / 255).reshape(-1, 1, 3), cv2.COLOR_RGB2Lab).reshape(-1, 3)
+    return colors
+
+
+def nearest_legend_entries(state_colors, legend_colors, color_space="rgb"):
+    """
+    Index of the closest legend color for every state color, computed as one
+    broadcasted (states x legend) squared-distance matrix. Ties go to the
+    first legend entry, as in the original per-state loop.
+    """
+    states = to_color_space(state_colors, color_space)
+    legend = to_color_space(legend_colors, color_space)
+    distances = ((states[:, None, :] - legend[None, :, :]) ** 2).sum(axis=2)
+    return distances.argmin(axis=1)
+
+
+def interpolate_continuous_values(state_colors, legend_colors, legend_values):
+    """
+    Values for all states of a continuous map at once. The legend colors form a
+    piecewise-linear ramp; every state color is projected onto each segment
+    (adjacent pair of legend colors), with the position A clamped to [0, 1]
+    so it stays on the segment. A state takes the segment whose projection is
+    closest to its color (the first one on ties) and the value interpolated
+    at A there. Colors past the ramp ends clamp to the end values.
+    """
+    states = np.asarray(state_colors, dtype=np.float64).reshape(-1, 3)
+    colors = np.asarray(legend_colors, dtype=np.float64).reshape(-1, 3)
+    values = np.asarray(legend_values, dtype=np.float64)
+    if len(colors) < 2:
+        return np.full(len(states), values[0] if len(values) else 0.0)
+
+    c1, c2 = colors[:-1], colors[1:]                      # (S, 3)
+    v1, v2 = values[:-1], values[1:]                      # (S,)
+    direction = c2 - c1
+    length = (direction ** 2).sum(axis=1)                 # (S,), 0 for two equal legend colors
+
+    # (N, S) position of each state's projection along each segment, 0 at c1 and 1 at c2
+    offsets = states[:, None, :] - c1[None, :, :]
+    A = (offsets * direction[None, :, :]).sum(axis=2) / np.where(length > 0, length, 1)
+    A = np.clip(A, 0, 1)
+
+    residuals = ((offsets - A[:, :, None] * direction[None, :, :]) ** 2).sum(axis=2)
+    best = residuals.argmin(axis=1)
+    rows = np.arange(len(states))
+    return v1[best] + A[rows, best] * (v2[best] - v1[best])
+
+
+def dominant_region_colors(image, masks, bits=5):
+    """
+    Representative color of every instance mask in one pass: pixels are quantized
+    to a (2**bits)^3 palette, the most frequent palette bin inside each mask is
+    found with a single bincount over all instances, and the mean of the real
+    pixels in that bin is returned. Borders, label text and anti-aliasing are
+    minorities inside a state, so they no longer decide its color.
+
+    image: (H, W, 3) BGR. masks: (N, H, W) bool.
+    Returns (N, 3) RGB ints and an (N,) bool array, False for empty masks.
+    """
+    n = len(masks)
+    bins = 1 << (3 * bits)
+    shift = 8 - bits
+
+    quantized = (image >> shift).astype(np.int64)
+    codes = (quantized[..., 2] << (2 * bits)) | (quantized[..., 1] << bits) | quantized[..., 0]
+
+    instance, ys, xs = np.nonzero(masks)
+    keys = instance * bins + codes[ys, xs]
+    counts = np.bincount(keys, minlength=n * bins).reshape(n, bins)
+    mode = counts.argmax(axis=1)
+    found = counts[np.arange(n), mode] > 0
+
+    # Mean RGB of the pixels falling in each instance's dominant bin
+    in_mode = codes[ys, xs] == mode[instance]
+    pixels = image[ys[in_mode], xs[in_mode]].astype(np.float64)
+    owners = instance[in_mode]
+    totals = np.maximum(np.bincount(owners, minlength=n), 1)
+    colors = np.stack([np.bincount(owners, weights=pixels[:, channel], minlength=n) / totals
+                       for channel in (2, 1, 0)], axis=1)
+    return np.rint(colors).astype(int), found
@@ -0,0 +1,131 @@
+import hashlib
+import json
+import os
+import threading
+
+import cv2
+import numpy as np
+from PIL import Image
+
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')    # lowercase: compare against lowercased names
+MANIFEST = "manifest.json"    # filename -> sha256 of the upload, written by utils.uploads
+REDUCED_READ_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+# PIL only reads image headers here. Its decompression bomb check (~179 MP) would reject the
+# large scans this pipeline is meant for, so sizes are checked against max_pixels instead
+Image.MAX_IMAGE_PIXELS = None
+
+
+class ImageTooLargeError(ValueError):
+    pass
+
+
+def image_size(path):
+    """(width, height) from the file header, without decoding the pixels."""
+    with Image.open(path) as header:
+        return header.size
+
+
+def check_pixels(path, max_pixels):
+    width, height = image_size(path)
+    if max_pixels and width * height > max_pixels:
+        raise ImageTooLargeError(f"{os.path.basename(path)} is {width}x{height}, "
+                                 f"larger than the limit of {max_pixels / 1e6:.0f} megapixels")
+    return width, height
+
+
+def read_image(path, max_side=None, max_pixels=None):
+    """
+    cv2.imread, but never larger than max_side on its longest side, and refusing
+    images over max_pixels. The size is read from the header first. JPEGs are
+    then decoded at 1/2, 1/4 or 1/8 scale directly where possible; PNGs are
+    always decoded at full size and resized afterwards, so a PNG briefly needs
+    width * height * 3 bytes - max_pixels is what bounds that.
+    """
+    flags = cv2.IMREAD_COLOR
+    if max_side or max_pixels:
+        longest = max(check_pixels(path, max_pixels))
+        for factor, reduced_flag in REDUCED_READ_FLAGS:
+            if max_side and longest // factor >= max_side:
+                flags = reduced_flag
+                break
+
+    image = cv2.imread(path, flags)
+    if image is not None and max_side and max(image.shape[:2]) > max_side:
+        scale = max_side / max(image.shape[:2])
+        size = (max(1, round(image.shape[1] * scale)), max(1, round(image.shape[0] * scale)))
+        image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+    return image
+
+
+class ImageStore:
+    """
+    Decodes each upload of a job once and hands the same BGR array to every stage.
+    Crops are NumPy views into that array, so stages must treat images as read-only.
+    Images larger than max_side are downscaled at decode time, and every stage
+    works in that resolution; images over max_pixels are refused.
+    """
+
+    def __init__(self, upload_dir, max_side=None, filenames=None, max_pixels=None):
+        self.upload_dir = upload_dir
+        self.max_side = max_side
+        self.max_pixels = max_pixels
+        if filenames is None:
+            filenames = (f for f in os.listdir(upload_dir) if f.lower().endswith(IMAGE_EXTENSIONS))
+        self.filenames = sorted(filenames)
+        self._images = {}
+        self._lock = threading.Lock()
+        self._decode_locks = {}     # one per filename: different images decode in parallel
+        # Hashes computed while the uploads were written
+        try:
+            with open(os.path.join(upload_dir, MANIFEST), encoding="utf-8") as manifest:
+                self._hashes = json.load(manifest)
+        except (OSError, ValueError):
+            self._hashes = {}
+
+    def get(self, filename):
+        with self._lock:
+            image = self._images.get(filename)
+            if image is not None:
+                return image
+            decode_lock = self._decode_locks.setdefault(filename, threading.Lock())
+
+        with decode_lock:
+            with self._lock:
+                image = self._images.get(filename)
+            if image is None:
+                image = read_image(os.path.join(self.upload_dir, filename), self.max_side, self.max_pixels)
+                if image is None:
+                    raise ValueError(f"Could not decode image: {filename}")
+                with self._lock:
+                    self._images[filename] = image
+            return image
+
+    def content_hash(self, filename):
+        if filename in self._hashes:
+            return self._hashes[filename]
+        sha = hashlib.sha256()
+        with open(os.path.join(self.upload_dir, filename), "rb") as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    def resnet_input(self, filename, size=(224, 224)):
+        # Same nearest-neighbour resize keras load_img(target_size=...) did, BGR -> RGB, scaled to [0, 1]
+        small = cv2.resize(self.get(filename), size, interpolation=cv2.INTER_NEAREST)
+        return small[:, :, ::-1].astype(np.float32) / 255
+
+    def crop(self, filename, y0, y1, x0, x1):
+        return self.get(filename)[y0:y1, x0:x1]
+
+    def release(self):
+        with self._lock:
+            self._images.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
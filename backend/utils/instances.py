@@ -0,0 +1,39 @@
+import numpy as np
+
+
+def instance_properties(masks, boxes=None):
+    """
+    Bounding box, centroid and area of every Detectron2 instance, straight from its mask.
+
+    masks: (N, H, W) bool pred_masks. boxes: optional (N, 4) pred_boxes (x0, y0, x1, y1),
+    used for instances whose mask came out empty.
+    Returns bboxes (N, 4) as (y0, x0, y1, x1) with exclusive ends like regionprops,
+    centroids (N, 2) as (y, x) and areas (N,). Row i always belongs to instance i,
+    so pred_classes[i] is its class.
+    """
+    n, height, width = masks.shape
+    row_counts = masks.sum(axis=2)      # (N, H)
+    col_counts = masks.sum(axis=1)      # (N, W)
+    areas = row_counts.sum(axis=1)
+
+    rows_any = row_counts > 0
+    cols_any = col_counts > 0
+    y0 = rows_any.argmax(axis=1)
+    y1 = height - rows_any[:, ::-1].argmax(axis=1)
+    x0 = cols_any.argmax(axis=1)
+    x1 = width - cols_any[:, ::-1].argmax(axis=1)
+    bboxes = np.stack([y0, x0, y1, x1], axis=1)
+
+    safe_areas = np.maximum(areas, 1)
+    centroid_y = (row_counts * np.arange(height)).sum(axis=1) / safe_areas
+    centroid_x = (col_counts * np.arange(width)).sum(axis=1) / safe_areas
+    centroids = np.stack([centroid_y, centroid_x], axis=1)
+
+    empty = areas == 0
+    if boxes is not None and empty.any():
+        box = np.asarray(boxes, dtype=np.float64)[empty]
+        bboxes[empty] = np.stack([np.floor(box[:, 1]), np.floor(box[:, 0]),
+                                  np.ceil(box[:, 3]), np.ceil(box[:, 2])], axis=1).astype(bboxes.dtype)
+        centroids[empty] = np.stack([(box[:, 1] + box[:, 3]) / 2, (box[:, 0] + box[:, 2]) / 2], axis=1)
+
+    return bboxes, centroids, areas
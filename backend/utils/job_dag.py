@@ -0,0 +1,54 @@
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+
+def run_per_image(filenames, task, stage_names, max_workers=4):
+    """
+    Runs task(filename, report) for every image of a job on a thread pool, so one
+    image can be in OCR while another is still being segmented. The task calls
+    report(stage_name) as it finishes each stage.
+
+    Yields ("stage", name) once every image has finished that stage, then
+    ("results", {filename: task result}). Reported names that are not stages
+    are passed through as ("event", name) right away. An exception in any
+    image's task is re-raised here.
+    """
+    events = queue.Queue()
+    remaining = {name: len(filenames) for name in stage_names}
+    results = {}
+
+    if not filenames:
+        for name in stage_names:
+            yield ("stage", name)
+        yield ("results", results)
+        return
+
+    def run(filename):
+        return task(filename, events.put)
+
+    pool = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(filenames))), thread_name_prefix="image")
+    try:
+        futures = {pool.submit(run, filename): filename for filename in filenames}
+        pending = set(futures)
+        while pending or not events.empty():
+            try:
+                stage = events.get(timeout=0.1)
+            except queue.Empty:
+                stage = None
+
+            if stage is not None and stage not in remaining:
+                yield ("event", stage)
+            elif stage is not None:
+                remaining[stage] -= 1
+                if remaining[stage] == 0:
+                    yield ("stage", stage)
+
+            for future in [f for f in pending if f.done()]:
+                pending.discard(future)
+                results[futures[future]] = future.result()
+    except BaseException:
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    pool.shutdown()
+
+    yield ("results", results)
@@ -0,0 +1,165 @@
+import collections
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+from utils.job_store import FINISHED
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, job_id, target, args):
+        self.job_id = job_id
+        self.target = target    # generator function, yields SSE payload strings
+        self.args = args
+        self.status = "queued"  # queued -> running (<-> waiting) -> done / failed
+        self.submitted_at = time.time()
+
+
+class JobScheduler:
+    """
+    Bounded job queue served by a fixed pool of worker threads.
+    Each job runs its pipeline generator on a worker and appends every yielded
+    payload to the job's event log in the JobStore, which SSE subscribers and
+    pollers read from, so a job runs to completion whether or not anyone is
+    listening. A generator may also yield a Future when it has to wait on I/O
+    (e.g. the LLM summary): the worker is released and the job resumes on the
+    thread that completes the Future.
+    """
+
+    def __init__(self, store, num_workers=1, max_queue_size=10, heartbeat_interval=10.0):
+        self.store = store
+        self.num_workers = max(1, num_workers)
+        self.max_queue_size = max_queue_size
+        self.heartbeat_interval = heartbeat_interval
+        self._pending = collections.deque()
+        self._jobs = {}
+        self._cond = threading.Condition()
+        self._start_lock = threading.Lock()
+        self._worker_pid = None
+
+    def _ensure_workers(self):
+        # Threads are started on first use, in the process that serves requests;
+        # with gunicorn --preload the app is imported in the master, whose threads are not forked
+        with self._start_lock:
+            if self._worker_pid == os.getpid():
+                return
+            self._worker_pid = os.getpid()
+            for i in range(self.num_workers):
+                worker = threading.Thread(target=self._worker_loop, name=f"pipeline-worker-{i}", daemon=True)
+                worker.start()
+            threading.Thread(target=self._heartbeat_loop, name="pipeline-heartbeat", daemon=True).start()
+
+    def _heartbeat_loop(self):
+        # Tells other processes that this one still owns its queued, running and waiting jobs
+        while True:
+            time.sleep(self.heartbeat_interval)
+            with self._cond:
+                job_ids = list(self._jobs)
+            for job_id in job_ids:
+                self.store.heartbeat(job_id)
+
+    def submit(self, job_id, target, *args):
+        """Queues the job and returns True, or False if job_id was already submitted (by any process)."""
+        self._ensure_workers()
+        with self._cond:
+            # A resubmitted job is not new work, so it gets False even when the queue is full
+            if self.store.state(job_id) is not None:
+                return False
+            if len(self._pending) >= self.max_queue_size:
+                raise QueueFullError(f"Job queue is full ({self.max_queue_size} waiting)")
+            if not self.store.create(job_id):
+                return False
+
+            job = Job(job_id, target, args)
+            self._jobs[job_id] = job
+            self._pending.append(job)
+            self._cond.notify()
+        self._announce_positions()
+        return True
+
+    def _announce_positions(self):
+        # 1-based position among waiting jobs, sent to each queued job's subscribers
+        with self._cond:
+            pending = list(self._pending)
+        for position, job in enumerate(pending, start=1):
+            self._emit(job, f"data: {json.dumps({'queue': {'position': position, 'workers': self.num_workers}})}\n\n")
+
+    def stats(self):
+        with self._cond:
+            running = sum(1 for job in self._jobs.values() if job.status == "running")
+            waiting = sum(1 for job in self._jobs.values() if job.status == "waiting")
+            return {"workers": self.num_workers, "queued": len(self._pending),
+                    "running": running, "waiting": waiting, "max_queue_size": self.max_queue_size}
+
+    def _emit(self, job, payload):
+        # Payloads are SSE strings ("data: <json>\n\n"); the store keeps the JSON
+        self.store.append(job.job_id, payload.strip()[len("data:"):].strip())
+
+    def _set_status(self, job, status):
+        job.status = status
+        self.store.update(job.job_id, status=status)
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                job = self._pending.popleft()
+
+            self._announce_positions()
+            self._drive(job, job.target(*job.args))
+
+    def _drive(self, job, generator):
+        finished = True
+        try:
+            self._set_status(job, "running")
+            for payload in generator:
+                if isinstance(payload, Future):
+                    finished = False
+                    self._set_status(job, "waiting")
+                    payload.add_done_callback(lambda _: self._drive(job, generator))
+                    return
+                if payload:
+                    self._emit(job, payload)
+            self._set_status(job, "done")
+        except Exception as e:
+            print(f"Job {job.job_id} failed: {e}")
+            self._emit(job, f"data: {json.dumps({'status': 'error', 'error': 'Processing failed'})}\n\n")
+            self._set_status(job, "failed")
+        finally:
+            if finished:
+                with self._cond:
+                    self._jobs.pop(job.job_id, None)
+
+
+def stream_job(store, job_id, last_event_id=0, poll_interval=0.5, keepalive_interval=15.0):
+    """
+    SSE generator over a job's event log, starting after last_event_id, so a
+    client that reconnects with Last-Event-ID picks up where it left off.
+    Ends once the job has finished and every event has been sent.
+    """
+    idle = 0.0
+    while True:
+        # State before events: anything logged before the job finished is still read below
+        state = store.check(job_id)
+        events = store.events(job_id, after=last_event_id)
+        for last_event_id, data in events:
+            yield f"id: {last_event_id}\ndata: {data}\n\n"
+
+        if events:
+            idle = 0.0
+            continue
+        if state is None or state["status"] in FINISHED:
+            break
+
+        time.sleep(poll_interval)
+        idle += poll_interval
+        if idle >= keepalive_interval:
+            idle = 0.0
+            yield ": keep-alive\n\n"
@@ -0,0 +1,140 @@
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+
+from utils.processes import pid_alive
+
+
+FINISHED = ("done", "failed")
+HOSTNAME = socket.gethostname()
+
+
+class JobStore:
+    """
+    On-disk job state shared by every gunicorn worker (jobs/<job_id>/).
+    state.json holds status and timestamps; events.jsonl is the job's event
+    log, one JSON payload per line, where line n has event id n. Only the
+    process running a job writes to it; any process can read it, so SSE
+    subscribers and pollers need not be served by the worker running the job.
+
+    The state records the owning process (host and pid) and a heartbeat its
+    scheduler refreshes; a job whose owner died, or whose heartbeat is older
+    than stale_after seconds, is marked failed by whichever process sees it next.
+    """
+
+    def __init__(self, directory, stale_after=60.0):
+        self.directory = directory
+        self.stale_after = stale_after
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, job_id, filename):
+        return os.path.join(self.directory, job_id, filename)
+
+    def create(self, job_id, **fields):
+        # mkdir is atomic across processes: exactly one submitter wins
+        try:
+            os.mkdir(os.path.join(self.directory, job_id))
+        except FileExistsError:
+            return False
+        now = time.time()
+        self._write_state(job_id, {"job_id": job_id, "status": "queued", "created_at": now, "updated_at": now,
+                                   "owner": {"host": HOSTNAME, "pid": os.getpid()}, "heartbeat": now, **fields})
+        return True
+
+    def update(self, job_id, **fields):
+        # Status changes and heartbeats come from different threads of the owner: no lost updates
+        with self._lock:
+            state = self.state(job_id) or {"job_id": job_id}
+            state.update(fields, updated_at=time.time())
+            self._write_state(job_id, state)
+
+    def heartbeat(self, job_id):
+        with self._lock:
+            state = self.state(job_id)
+            if state is None or state["status"] in FINISHED:
+                return
+            state["heartbeat"] = time.time()
+            self._write_state(job_id, state)
+
+    def _write_state(self, job_id, state):
+        path = self._path(job_id, "state.json")
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(state, file)
+        os.replace(tmp_path, path)
+
+    def state(self, job_id):
+        try:
+            with open(self._path(job_id, "state.json"), encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def is_stale(self, state):
+        if state is None or state["status"] in FINISHED:
+            return False
+        owner = state.get("owner") or {}
+        if owner.get("host") == HOSTNAME and not pid_alive(owner.get("pid", 0)):
+            return True
+        return time.time() - state.get("heartbeat", state["updated_at"]) > self.stale_after
+
+    def check(self, job_id):
+        """state(), but a job abandoned by a dead process is marked failed first."""
+        state = self.state(job_id)
+        if not self.is_stale(state):
+            return state
+        # Exactly one process records the failure, however many notice it at once
+        try:
+            os.close(os.open(self._path(job_id, "abandoned"), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            return self.state(job_id)
+        except OSError:
+            return state
+        print(f"Job {job_id} was abandoned by process {state.get('owner')}, marking it failed")
+        self.append(job_id, json.dumps({"status": "error", "error": "Processing was interrupted, please upload again"}))
+        self.update(job_id, status="failed", abandoned=True)
+        return self.state(job_id)
+
+    def append(self, job_id, data):
+        """data: JSON string of one event payload; its event id is its line number in the log."""
+        with self._lock:
+            with open(self._path(job_id, "events.jsonl"), "a", encoding="utf-8") as file:
+                file.write(data + "\n")
+
+    def events(self, job_id, after=0):
+        """[(event_id, data)] of the events after event id `after`."""
+        try:
+            with open(self._path(job_id, "events.jsonl"), encoding="utf-8") as file:
+                lines = file.readlines()
+        except OSError:
+            return []
+        # A line without its newline is still being written
+        return [(i + 1, line.rstrip("\n")) for i, line in enumerate(lines) if i >= after and line.endswith("\n")]
+
+    def snapshot(self, job_id):
+        """Job state plus all event payloads folded into one dict (later keys win), for polling clients."""
+        state = self.check(job_id)
+        if state is None:
+            return None
+        data = {}
+        events = self.events(job_id)
+        for _, payload in events:
+            data.update(json.loads(payload))
+        return {"job": state, "data": data, "last_event_id": len(events)}
+
+    def cleanup(self, max_age_seconds):
+        # Finished jobs are kept for reconnects and polling, then dropped; abandoned ones are failed
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.isdir(path):
+                    self.check(name)
+                if os.path.isdir(path) and now - os.path.getmtime(path) > max_age_seconds:
+                    shutil.rmtree(path, ignore_errors=True)
+            except OSError as e:
+                print(f"Error checking job {path}: {e}")
@@ -0,0 +1,45 @@
+import numpy as np
+
+
+def sample_swatch_color(legend, word_box, tolerance=10):
+    """
+    Median color of the legend swatch to the left of an OCR'd legend label.
+
+    legend: BGR legend crop. word_box: PaddleOCR quad [[x, y], ...] of the label.
+    The background is the pixel at the label's left edge (mid-height); within the
+    label's central rows, columns left of the label that are mostly non-background
+    are found in one vectorized comparison, and the run closest to the label is
+    taken as the swatch. Returns (b, g, r) ints, or None when no swatch is found.
+    """
+    height, width = legend.shape[:2]
+    x = int(min(max(word_box[0][0], 0), width - 1))
+    top, bottom = word_box[0][1], word_box[2][1]
+    y_mid = int(min(max((top + bottom) / 2, 0), height - 1))
+    if x == 0:
+        return None
+
+    # Central half of the label's height, clamped to the crop
+    half = max(1, int(abs(bottom - top) / 4))
+    y0, y1 = max(0, y_mid - half), min(height, y_mid + half + 1)
+
+    background = legend[y_mid, x].astype(np.int16)
+    band = legend[y0:y1, :x]
+    is_background = np.all(np.abs(band.astype(np.int16) - background) <= tolerance, axis=2)
+    swatch_columns = (~is_background).mean(axis=0) > 0.5
+
+    columns = np.flatnonzero(swatch_columns)
+    if columns.size == 0:
+        return None
+    end = columns[-1]
+    gaps = np.flatnonzero(~swatch_columns[:end + 1])
+    start = gaps[-1] + 1 if gaps.size else 0
+
+    # Skip the anti-aliased edges of wide swatches
+    trim = (end + 1 - start) // 4
+    run = band[:, start + trim:end + 1 - trim]
+    pixels = run[~is_background[:, start + trim:end + 1 - trim]]
+    if len(pixels) == 0:
+        return None
+
+    blue, green, red = np.median(pixels, axis=0)
+    return int(round(blue)), int(round(green)), int(round(red))
@@ -0,0 +1,127 @@
+import collections
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+from utils.telemetry import span
+
+
+class MicroBatcher:
+    """
+    Collects work items submitted by any number of jobs and runs them through a
+    model together. Items arriving within window_ms of each other are grouped,
+    put in batch_order(), split into forward passes of at most max_batch_size
+    items and handed to forward(); each caller gets back the results for its own
+    items. Subclasses implement forward() and may override batch_order().
+    """
+
+    name = "batcher"
+
+    def __init__(self, max_batch_size=16, window_ms=20):
+        self.max_batch_size = max(1, max_batch_size)
+        self.window = window_ms / 1000.0
+        self._requests = queue.Queue()
+        self._lock = threading.Lock()
+        self._latencies = collections.deque(maxlen=200)   # (batch size, seconds)
+        self._batches = 0
+        self._items = 0
+        self._start_lock = threading.Lock()
+        self._worker_pid = None
+
+    def forward(self, items):
+        raise NotImplementedError
+
+    def batch_order(self, items):
+        return list(range(len(items)))
+
+    def _ensure_worker(self):
+        # Started on first use so that a forked gunicorn worker gets its own batching thread
+        with self._start_lock:
+            if self._worker_pid == os.getpid():
+                return
+            self._worker_pid = os.getpid()
+            worker = threading.Thread(target=self._loop, name=self.name, daemon=True)
+            worker.start()
+
+    def submit(self, items):
+        if not items:
+            return []
+        self._ensure_worker()
+
+        request = {"items": items, "results": None, "error": None, "done": threading.Event()}
+        self._requests.put(request)
+        request["done"].wait()
+
+        if request["error"] is not None:
+            raise request["error"]
+        return request["results"]
+
+    def stats(self):
+        with self._lock:
+            latencies = [seconds for _, seconds in self._latencies]
+            sizes = [size for size, _ in self._latencies]
+            return {
+                "batches": self._batches,
+                "images": self._items,
+                "max_batch_size": self.max_batch_size,
+                "last_batch_ms": round(latencies[-1] * 1000, 2) if latencies else None,
+                "mean_batch_ms": round(float(np.mean(latencies)) * 1000, 2) if latencies else None,
+                "p95_batch_ms": round(float(np.percentile(latencies, 95)) * 1000, 2) if latencies else None,
+                "mean_batch_size": round(float(np.mean(sizes)), 2) if sizes else None,
+            }
+
+    def _collect(self):
+        # Block for the first request, then keep gathering until the window closes or the batch is full
+        pending = [self._requests.get()]
+        count = len(pending[0]["items"])
+        deadline = time.monotonic() + self.window
+        while count < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self._requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            pending.append(request)
+            count += len(request["items"])
+        return pending
+
+    def _loop(self):
+        while True:
+            pending = self._collect()
+            items = [item for request in pending for item in request["items"]]
+            try:
+                results = [None] * len(items)
+                order = self.batch_order(items)
+                for start in range(0, len(order), self.max_batch_size):
+                    indices = order[start:start + self.max_batch_size]
+                    started = time.perf_counter()
+                    # Process CPU: the forward pass runs on torch's intra-op threads, not just this one
+                    with span(self.name, cpu="process", batch_size=len(indices)):
+                        outputs = self.forward([items[i] for i in indices])
+                    self._record(len(indices), time.perf_counter() - started)
+                    for i, output in zip(indices, outputs):
+                        results[i] = output
+
+                offset = 0
+                for request in pending:
+                    n = len(request["items"])
+                    request["results"] = results[offset:offset + n]
+                    offset += n
+            except Exception as e:
+                for request in pending:
+                    request["error"] = e
+            finally:
+                for request in pending:
+                    request["done"].set()
+
+    def _record(self, batch_size, seconds):
+        with self._lock:
+            self._latencies.append((batch_size, seconds))
+            self._batches += 1
+            self._items += batch_size
+        print(f"{self.name}: batch of {batch_size} in {seconds * 1000:.1f} ms")
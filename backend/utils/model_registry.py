@@ -0,0 +1,259 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+# TensorFlow, Detectron2 and PaddleOCR are imported inside the loaders so that
+# importing this module (and the Flask app) stays cheap; see MODEL_LOADING.
+
+
+# RESNET Model
+MODEL_PATH_RESNET = "model/Trained_Models/Colab/resnet50.h5"
+
+# Annotation detectron2 model
+MODEL_PATH_ANNOTATION = "model/Trained_Models/Colab/annotation/detectron2_annotation.pth"
+CONFIG_PATH_ANNOTATION = "model/Trained_Models/Colab/annotation/config.yaml"
+annotation_dataset_name = "annotation_dataset_train"
+annotation_class_names = ["title", "legend"]
+
+# State Segmentation detectron2 model
+MODEL_PATH_STATES = "model/Trained_Models/Colab/detectron2.pth"
+CONFIG_PATH_STATES = "model/Trained_Models/Colab/config.yaml"
+states_dataset_name = "states_dataset_train"
+class_names = ["Washington", "Idaho", "Montana", "North Dakota", "South Dakota", "Minnesota", "Iowa", "Wisconsin",
+               "Illinois", "Indiana", "Michigan", "Ohio", "Pennsylvania", "New York", "Vermont", "New Hampshire",
+               "Maine", "Massachusetts", "Rhode Island", "Connecticut", "New Jersey", "Delaware", "Maryland",
+               "West Virginia", "Virginia", "Kentucky", "Tennessee", "North Carolina", "South Carolina", "Georgia",
+               "Alabama", "Mississippi", "Florida", "Louisiana", "Arkansas", "Oklahoma", "Texas", "New Mexico",
+               "Colorado", "Wyoming", "Nebraska", "Utah", "Arizona", "Nevada", "California", "Oregon", "Alaska",
+               "Hawaii", "Kansas", "Missouri"]
+
+# Images per Detectron2 forward pass, and how long to wait for other jobs' images
+DETECTRON2_MAX_BATCH = int(os.getenv("DETECTRON2_MAX_BATCH", "4"))
+DETECTRON2_BATCH_WINDOW_MS = int(os.getenv("DETECTRON2_BATCH_WINDOW_MS", "20"))
+
+
+def model_versions():
+    # Identifies the weights in use, so cached results from other weights are never reused
+    parts = []
+    for path in (MODEL_PATH_RESNET, MODEL_PATH_ANNOTATION, CONFIG_PATH_ANNOTATION, MODEL_PATH_STATES, CONFIG_PATH_STATES):
+        try:
+            stat = os.stat(path)
+            parts.append(f"{path}:{stat.st_size}:{int(stat.st_mtime)}")
+        except OSError:
+            parts.append(f"{path}:missing")
+    return "|".join(parts)
+
+
+def load_resnet():
+    import tensorflow as tf
+    return tf.keras.models.load_model(MODEL_PATH_RESNET)
+
+
+def make_predictor(config_path, weights_path, dataset_name, thing_classes):
+    from detectron2.config import get_cfg
+    from detectron2.engine import DefaultPredictor
+    from detectron2.data import MetadataCatalog
+
+    cfg = get_cfg()
+    cfg.merge_from_file(config_path)
+    cfg.MODEL.WEIGHTS = weights_path
+    cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST = 0.5  # confidence threshold
+    cfg.MODEL.DEVICE = "cpu"
+    cfg.DATASETS.TRAIN = (dataset_name,)
+
+    MetadataCatalog.get(dataset_name).thing_classes = thing_classes
+    return DefaultPredictor(cfg)
+
+
+def load_annotation_predictor():
+    from utils.batch_predictor import BatchPredictor
+
+    # Detectron2 model for the segmentation of the components
+    predictor = make_predictor(CONFIG_PATH_ANNOTATION, MODEL_PATH_ANNOTATION, annotation_dataset_name, annotation_class_names)
+    return BatchPredictor(predictor, DETECTRON2_MAX_BATCH, DETECTRON2_BATCH_WINDOW_MS, name="annotation-batcher")
+
+
+def load_states_predictor():
+    from utils.batch_predictor import BatchPredictor
+
+    # Detectron2 model for segmentation of states
+    predictor = make_predictor(CONFIG_PATH_STATES, MODEL_PATH_STATES, states_dataset_name, class_names)
+    return BatchPredictor(predictor, DETECTRON2_MAX_BATCH, DETECTRON2_BATCH_WINDOW_MS, name="states-batcher")
+
+
+class SerializedOCR:
+    # PaddleOCR predictors are not safe to call from several threads at once
+    def __init__(self, ocr_model):
+        self.ocr_model = ocr_model
+        self._lock = threading.Lock()
+
+    def ocr(self, *args, **kwargs):
+        with self._lock:
+            return self.ocr_model.ocr(*args, **kwargs)
+
+
+def load_ocr():
+    from paddleocr import PaddleOCR
+    return SerializedOCR(PaddleOCR(lang='en'))
+
+
+def warmup_resnet(model):
+    model.predict_on_batch(np.zeros((1, 224, 224, 3), dtype=np.float32))
+
+
+def warmup_predictor(predictor):
+    from utils.batch_predictor import configure_torch_threads
+
+    # Warm-up always runs in the serving process (also after a preload fork), so set threads here
+    configure_torch_threads()
+    predictor(np.full((256, 256, 3), 255, dtype=np.uint8))
+
+
+def warmup_ocr(ocr_model):
+    ocr_model.ocr(np.full((48, 192, 3), 255, dtype=np.uint8), cls=False)
+
+
+class ModelRegistry:
+    """
+    Owns every model the pipeline uses. Each worker process loads them once,
+    runs a dummy inference through each, and keeps per-model timings for /health.
+
+    Loading can happen eagerly (load_all), on a background thread
+    (start_background_load) or lazily on the first wait_until_ready() call.
+
+    For gunicorn --preload, preload() loads the fork-safe models in the master
+    without running them, so their weights are shared copy-on-write by every
+    worker; each worker then calls after_fork() to load the rest and warm up.
+    """
+
+    def __init__(self):
+        self._loaders = {}
+        self._models = {}
+        self._warmed = set()
+        self._status = {}
+        self._lock = threading.Lock()
+        self._ready_event = threading.Event()
+        self._started = False
+        self._created_at = time.perf_counter()
+        self.startup_seconds = None
+        self.error = None
+
+    def register(self, name, loader, warmup=None, fork_safe=False):
+        self._loaders[name] = (loader, warmup, fork_safe)
+        self._status[name] = {"loaded": False, "preloaded": False, "load_seconds": None, "warmup_seconds": None}
+
+    def _load_weights(self, name):
+        if name in self._models:
+            return self._models[name]
+
+        loader = self._loaders[name][0]
+        started = time.perf_counter()
+        model = loader()
+        self._models[name] = model
+        self._status[name]["load_seconds"] = round(time.perf_counter() - started, 3)
+        return model
+
+    def load(self, name):
+        with self._lock:
+            model = self._load_weights(name)
+            if name in self._warmed:
+                return model
+
+            warmup = self._loaders[name][1]
+            started = time.perf_counter()
+            if warmup is not None:
+                warmup(model)
+            self._warmed.add(name)
+
+            status = self._status[name]
+            status.update({"loaded": True, "warmup_seconds": round(time.perf_counter() - started, 3)})
+            print(f"Model '{name}' loaded in {status['load_seconds']}s, warm-up {status['warmup_seconds']}s")
+            return model
+
+    def preload(self):
+        # Runs in the gunicorn master before forking: no inference here, since
+        # thread pools started by a forward pass do not survive fork()
+        for name, (_, _, fork_safe) in self._loaders.items():
+            if fork_safe:
+                self._load_weights(name)
+                self._status[name]["preloaded"] = True
+                print(f"Model '{name}' preloaded in {self._status[name]['load_seconds']}s")
+
+    def after_fork(self):
+        # Locks and events copied from the master may be in any state; start clean in the worker
+        self._lock = threading.Lock()
+        self._ready_event = threading.Event()
+        self._started = False
+        self._created_at = time.perf_counter()
+        self.start_background_load()
+
+    def load_all(self):
+        self._started = True
+        try:
+            for name in self._loaders:
+                self.load(name)
+        except Exception as e:
+            self.error = str(e)
+            print(f"Model loading failed: {e}")
+            self._ready_event.set()     # wake up waiters so they see the error
+            raise
+
+        self.startup_seconds = round(time.perf_counter() - self._created_at, 3)
+        self._ready_event.set()
+        self.print_startup_report()
+
+    def start_background_load(self):
+        def target():
+            try:
+                self.load_all()
+            except Exception:
+                pass    # kept in self.error, reported by /health
+
+        self._started = True
+        threading.Thread(target=target, name="model-loader", daemon=True).start()
+
+    def wait_until_ready(self, timeout=None):
+        if not self._started:
+            self.load_all()     # lazy mode: the first inference request pays for loading
+        self._ready_event.wait(timeout)
+        if self.error:
+            raise RuntimeError(f"Models failed to load: {self.error}")
+        return self.ready
+
+    def print_startup_report(self):
+        print("Model startup report:")
+        for name, status in self._status.items():
+            print(f"  {name:<12} load {status['load_seconds']}s  warm-up {status['warmup_seconds']}s")
+        print(f"  ready {self.startup_seconds}s after registry creation")
+
+    def get(self, name):
+        if name in self._warmed:
+            return self._models[name]
+        return self.load(name)
+
+    @property
+    def ready(self):
+        return all(status["loaded"] for status in self._status.values())
+
+    def status(self):
+        return {
+            "ready": self.ready,
+            "pid": os.getpid(),
+            "loading": self._started and not self._ready_event.is_set(),
+            "startup_seconds": self.startup_seconds,
+            "error": self.error,
+            "models": {name: dict(status) for name, status in self._status.items()},
+        }
+
+
+def create_registry():
+    registry = ModelRegistry()
+    registry.register("resnet", load_resnet, warmup_resnet)
+    # Only the PyTorch predictors are shared across forked workers; TensorFlow and
+    # Paddle runtimes are not fork-safe once initialised, so each worker loads its own
+    registry.register("annotation", load_annotation_predictor, warmup_predictor, fork_safe=True)
+    registry.register("states", load_states_predictor, warmup_predictor, fork_safe=True)
+    registry.register("ocr", load_ocr, warmup_ocr)
+    return registry
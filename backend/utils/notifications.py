@@ -0,0 +1,211 @@
+import json
+import os
+import smtplib
+import threading
+import time
+import uuid
+from email.message import EmailMessage
+
+from utils.processes import pid_alive
+
+
+class SendGridTransport:
+    def __init__(self, api_key=None, sender=None):
+        self.api_key = api_key or os.getenv("SENDGRID_API_KEY")
+        self.sender = sender or os.getenv("MAIL_DEFAULT_SENDER")
+
+    def send(self, messages):
+        from sendgrid import SendGridAPIClient
+        from sendgrid.helpers.mail import Mail
+
+        # One client (and connection) for the whole batch
+        sg = SendGridAPIClient(self.api_key)
+        errors = []
+        for message in messages:
+            try:
+                response = sg.send(Mail(from_email=self.sender, to_emails=message["to"],
+                                        subject=message["subject"], html_content=message["html"]))
+                print(f"Email to {message['to']}: {response.status_code}")
+                errors.append(None)
+            except Exception as e:
+                errors.append(str(e))
+        return errors
+
+
+class SMTPTransport:
+    # Works against any SMTP server, e.g. a local debug server: python -m aiosmtpd -n -l localhost:1025
+    def __init__(self, host=None, port=None, sender=None):
+        self.host = host or os.getenv("SMTP_HOST", "localhost")
+        self.port = int(port or os.getenv("SMTP_PORT", "1025"))
+        self.sender = sender or os.getenv("MAIL_DEFAULT_SENDER") or "noreply@localhost"
+
+    def send(self, messages):
+        errors = []
+        try:
+            with smtplib.SMTP(self.host, self.port, timeout=30) as smtp:
+                for message in messages:
+                    email = EmailMessage()
+                    email["From"], email["To"], email["Subject"] = self.sender, message["to"], message["subject"]
+                    email.set_content(message["html"], subtype="html")
+                    try:
+                        smtp.send_message(email)
+                        errors.append(None)
+                    except smtplib.SMTPException as e:
+                        errors.append(str(e))
+        except (OSError, smtplib.SMTPException) as e:
+            return [str(e)] * len(messages)
+        return errors
+
+
+class FileTransport:
+    # Local stand-in: appends every message to outbox.jsonl instead of sending it
+    def __init__(self, directory=None):
+        self.directory = directory or os.getenv("EMAIL_OUTBOX_DIR", "outbox")
+
+    def send(self, messages):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, "outbox.jsonl"), "a", encoding="utf-8") as file:
+            for message in messages:
+                file.write(json.dumps({**message, "sent_at": time.time()}) + "\n")
+        return [None] * len(messages)
+
+
+TRANSPORTS = {"sendgrid": SendGridTransport, "smtp": SMTPTransport, "file": FileTransport}
+
+
+def make_transport(name=None):
+    return TRANSPORTS[name or os.getenv("EMAIL_TRANSPORT", "sendgrid")]()
+
+
+class EmailDispatcher:
+    """
+    Sends notification emails from a background thread so the pipeline never
+    waits on the mail provider. Each queued message is a JSON file in
+    queue_dir, so messages survive restarts and are shared by gunicorn workers
+    (a worker claims a file by renaming it). Up to batch_size due messages go
+    to the transport at once; failures are retried with exponential backoff and
+    moved to queue_dir/failed after max_attempts. Claims left by a process that
+    died mid-send, or older than claim_timeout seconds, go back to the queue
+    when a dispatcher starts.
+    """
+
+    def __init__(self, queue_dir, transport, max_attempts=5, backoff_seconds=30, batch_size=20,
+                 poll_interval=5.0, claim_timeout=15 * 60):
+        self.queue_dir = queue_dir
+        self.failed_dir = os.path.join(queue_dir, "failed")
+        self.transport = transport
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.claim_timeout = claim_timeout
+        self.sent = 0
+        self.failed = 0
+        self._wake = threading.Event()
+        self._start_lock = threading.Lock()
+        self._worker_pid = None
+        os.makedirs(self.failed_dir, exist_ok=True)
+
+    def start(self):
+        # Pid-aware like the job scheduler: after a fork the worker process starts its own thread
+        with self._start_lock:
+            if self._worker_pid == os.getpid():
+                return
+            self._worker_pid = os.getpid()
+            self._recover_claims()
+            threading.Thread(target=self._loop, name="email-dispatcher", daemon=True).start()
+
+    def _recover_claims(self):
+        now = time.time()
+        for name in os.listdir(self.queue_dir):
+            if not name.endswith(".claim"):
+                continue
+            path = os.path.join(self.queue_dir, name)
+            message_path, pid = name[:-len(".claim")].rsplit(".", 1)
+            message_path = os.path.join(self.queue_dir, message_path)
+            try:
+                if pid_alive(int(pid)) and now - os.path.getmtime(path) < self.claim_timeout:
+                    continue
+                if os.path.exists(message_path):
+                    os.remove(path)     # already rewritten for a retry before the claim was dropped
+                else:
+                    os.rename(path, message_path)
+                    print(f"Requeued email claimed by process {pid}: {message_path}")
+            except (OSError, ValueError):
+                continue
+
+    def enqueue(self, to, subject, html):
+        message = {"id": uuid.uuid4().hex, "to": to, "subject": subject, "html": html,
+                   "attempts": 0, "next_attempt": 0, "errors": []}
+        self._write(message)
+        self.start()
+        self._wake.set()
+        return message["id"]
+
+    def stats(self):
+        queued = sum(1 for name in os.listdir(self.queue_dir) if name.endswith(".json"))
+        return {"queued": queued, "sent": self.sent, "failed": self.failed}
+
+    def _path(self, message_id, directory=None):
+        return os.path.join(directory or self.queue_dir, f"{message_id}.json")
+
+    def _write(self, message, directory=None):
+        path = self._path(message["id"], directory)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(message, file)
+        os.replace(tmp_path, path)
+
+    def _claim_due(self):
+        now = time.time()
+        claimed = []
+        for name in sorted(os.listdir(self.queue_dir)):
+            if len(claimed) >= self.batch_size:
+                break
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.queue_dir, name)
+            try:
+                with open(path, encoding="utf-8") as file:
+                    message = json.load(file)
+                if message["next_attempt"] > now:
+                    continue
+                os.rename(path, f"{path}.{os.getpid()}.claim")
+            except (OSError, ValueError):
+                continue    # another worker got it first, or it is being written
+            claimed.append(message)
+        return claimed
+
+    def _loop(self):
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            batch = self._claim_due()
+            while batch:
+                self._send(batch)
+                batch = self._claim_due()
+
+    def _send(self, batch):
+        try:
+            errors = self.transport.send(batch)
+        except Exception as e:
+            errors = [str(e)] * len(batch)
+
+        for message, error in zip(batch, errors):
+            claim_path = f"{self._path(message['id'])}.{os.getpid()}.claim"
+            if error is None:
+                self.sent += 1
+            else:
+                print(f"Email to {message['to']} failed: {error}")
+                message["attempts"] += 1
+                message["errors"].append(error)
+                message["next_attempt"] = time.time() + self.backoff_seconds * 2 ** (message["attempts"] - 1)
+                if message["attempts"] >= self.max_attempts:
+                    self.failed += 1
+                    self._write(message, self.failed_dir)
+                else:
+                    self._write(message)
+            try:
+                os.remove(claim_path)
+            except OSError:
+                pass
@@ -0,0 +1,12 @@
+import os
+
+
+def pid_alive(pid):
+    """True if a process with this pid exists on this host (one we may not signal counts too)."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
@@ -0,0 +1,85 @@
+import os
+from dataclasses import dataclass, field, asdict
+
+import pandas as pd
+
+
+# In-memory records handed from one pipeline stage to the next.
+# Colors are always (r, g, b) tuples of ints, bounding boxes (y0, x0, y1, x1), centroids (y, x).
+
+@dataclass
+class StateRegion:
+    name: str
+    centroid: tuple
+    bbox: tuple
+    color: tuple
+
+
+@dataclass
+class LegendEntry:
+    value: float
+    unit: str
+    color: tuple
+
+
+@dataclass
+class MapResult:
+    file_name: str
+    map_type: str = None        # "discrete" / "continuous"
+    title_bbox: tuple = None
+    legend_bbox: tuple = None
+    map_title: str = None
+    states: list = field(default_factory=list)     # [StateRegion]
+    legend: list = field(default_factory=list)     # [LegendEntry]
+
+
+def format_color(color):
+    return f"({color[0]}, {color[1]}, {color[2]})"
+
+
+def export_debug_tables(maps, output_dir):
+    """
+    Optional debug sink: writes the per-stage tables the pipeline used to pass
+    around on disk (classification, components, state segmentation, OCR).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    maps = list(maps)
+
+    pd.DataFrame(
+        [(m.file_name, m.map_type) for m in maps],
+        columns=["file name", "Type"],
+    ).to_csv(os.path.join(output_dir, "classification.csv"), index=False)
+
+    pd.DataFrame(
+        [(m.file_name, m.legend_bbox, m.title_bbox) for m in maps],
+        columns=["file name", "legend bounding box", "title bounding box"],
+    ).to_csv(os.path.join(output_dir, "output_objects.csv"), index=False)
+
+    pd.DataFrame(
+        [(m.file_name, s.name, i + 1, s.centroid, s.bbox, format_color(s.color))
+         for m in maps for i, s in enumerate(m.states)],
+        columns=["File Name", "Class Name", "Object Number", "Centroid", "BoundingBox", "RGB Color"],
+    ).to_csv(os.path.join(output_dir, "output_objects_state_segmentation.csv"), index=False)
+
+    pd.DataFrame(
+        [(m.file_name, m.map_type, m.map_title, e.value, e.unit, format_color(e.color))
+         for m in maps for e in m.legend],
+        columns=["file_name", "map_type", "map_title", "value", "unit", "RGB color"],
+    ).to_csv(os.path.join(output_dir, "OCR_output.csv"), index=False)
+
+    print(f"Debug tables written to {output_dir}")
+
+
+def map_result_to_dict(map_result):
+    return asdict(map_result)
+
+
+def map_result_from_dict(data):
+    data = dict(data)
+    data["states"] = [StateRegion(s["name"], tuple(s["centroid"]), tuple(s["bbox"]), tuple(s["color"]))
+                      for s in data["states"]]
+    data["legend"] = [LegendEntry(e["value"], e["unit"], tuple(e["color"])) for e in data["legend"]]
+    for key in ("title_bbox", "legend_bbox"):
+        if data[key] is not None:
+            data[key] = tuple(data[key])
+    return MapResult(**data)
@@ -0,0 +1,113 @@
+import collections
+import hashlib
+import json
+import os
+import threading
+
+from utils.records import map_result_to_dict, map_result_from_dict
+
+
+class ResultCache:
+    """
+    Content-addressed cache of per-image stage outputs (legend type, component
+    boxes, state regions and colors, parsed legend entries), keyed by the image
+    bytes and the model versions. A small LRU lives in memory; everything is also
+    kept as JSON under `directory`, trimmed oldest-first to max_disk_bytes.
+    """
+
+    def __init__(self, directory, version, memory_items=256, max_disk_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.version = version
+        self.memory_items = memory_items
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, content_hash):
+        return hashlib.sha256(f"{self.version}:{content_hash}".encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key):
+        """Returns (map_result, found_components) or None."""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+
+        if entry is None:
+            path = self._path(key)
+            try:
+                with open(path, encoding="utf-8") as file:
+                    entry = json.load(file)
+                os.utime(path)  # recently used, keep it on disk
+            except (OSError, ValueError):
+                entry = None
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, entry)
+        return map_result_from_dict(entry["map_result"]), entry["found_components"]
+
+    def put(self, key, map_result, found_components):
+        entry = {"map_result": map_result_to_dict(map_result), "found_components": found_components}
+        with self._lock:
+            self._remember(key, entry)
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump(entry, file)
+            os.replace(tmp_path, path)     # atomic, other workers never see half a file
+        except OSError as e:
+            print(f"Result cache write failed: {e}")
+            return
+
+        # Walking the cache folder is not free, so only check the disk budget now and then
+        with self._lock:
+            self._puts += 1
+            check_disk = self._puts % 50 == 1
+        if check_disk:
+            self._evict_disk()
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self):
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith(".json"):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "memory_items": len(self._memory)}
@@ -0,0 +1,339 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from utils.records import MapResult, StateRegion, LegendEntry
+from utils.model_registry import annotation_class_names, class_names, model_versions, DETECTRON2_MAX_BATCH
+from utils.instances import instance_properties
+from utils.legend_swatch import sample_swatch_color
+from utils.color_matching import nearest_legend_entries, interpolate_continuous_values, dominant_region_colors
+from utils.tiling import TilingConfig, tile_grid, tile_instances, merge_instances
+from utils.telemetry import span
+
+
+# ------------------------------------------------------------------------------------------
+# Stage 1: legend type classification (RESNET)
+
+def classify_map(classifier, images, filename):
+    score = classifier.classify([images.resnet_input(filename)])[0]
+    print(f"Prediction for {filename}: {score}")
+    img_type = "continuous" if score > 0.5 else "discrete"
+    return MapResult(file_name=filename, map_type=img_type)
+
+
+# ------------------------------------------------------------------------------------------
+# Stage 2: map component segmentation (title / legend)
+
+def annotate_map(model_annotation, thing_classes, images, map_result):
+    """Fills title_bbox / legend_bbox. Returns False when no component was found at all."""
+    instances = model_annotation(images.get(map_result.file_name))["instances"].to("cpu")
+
+    mask = instances.pred_masks.numpy().astype(bool)
+    class_labels = instances.pred_classes.numpy()
+    bboxes, _, _ = instance_properties(mask, instances.pred_boxes.tensor.numpy())
+
+    # Instances come sorted by score, so the first title / legend of a map is the most confident one
+    for i, class_label in enumerate(class_labels):
+        class_name = thing_classes[class_label]
+        box = tuple(int(v) for v in bboxes[i])
+        if class_name == "legend" and map_result.legend_bbox is None:
+            map_result.legend_bbox = box
+        elif class_name == "title" and map_result.title_bbox is None:
+            map_result.title_bbox = box
+    return len(class_labels) > 0
+
+
+# ------------------------------------------------------------------------------------------
+# Stage 3: state segmentation
+
+def segment_map_states(model_states, thing_classes, images, map_result, tiling=None):
+    new_im = images.get(map_result.file_name)
+    if tiling is not None and tiling.should_tile(new_im.shape):
+        segment_map_states_tiled(model_states, thing_classes, new_im, map_result, tiling)
+        return
+
+    instances = model_states(new_im)["instances"].to("cpu")
+
+    mask = instances.pred_masks.numpy().astype(bool)
+    class_labels = instances.pred_classes.numpy()
+    bboxes, centroids, areas = instance_properties(mask)
+    region_colors, _ = dominant_region_colors(new_im, mask)
+
+    # Instance i is pred_classes[i]; an empty mask has no pixels to take a color from
+    for i in np.flatnonzero(areas > 0):
+        map_result.states.append(StateRegion(
+            name=thing_classes[class_labels[i]],
+            centroid=tuple(float(v) for v in centroids[i]),
+            bbox=tuple(int(v) for v in bboxes[i]),
+            color=tuple(int(c) for c in region_colors[i]),
+        ))
+
+
+def segment_map_states_tiled(model_states, thing_classes, new_im, map_result, tiling):
+    """
+    State segmentation for large images: overlapping tiles go through the
+    predictor tiling.batch_size at a time, each detection is kept only as a mask
+    cropped to its box, and detections of one state split by a seam are merged.
+    Small states keep far more pixels than when the whole map is downscaled.
+    """
+    windows = tile_grid(new_im.shape[0], new_im.shape[1], tiling.tile_size, tiling.overlap)
+    found = []
+    for start in range(0, len(windows), tiling.batch_size):
+        chunk = windows[start:start + tiling.batch_size]
+        outputs = model_states.predict([new_im[y0:y1, x0:x1] for y0, x0, y1, x1 in chunk])
+        for window, output in zip(chunk, outputs):
+            instances = output["instances"].to("cpu")
+            found += tile_instances(instances.pred_masks.numpy().astype(bool), instances.pred_classes.numpy(), window)
+
+    for instance in merge_instances(found):
+        y0, x0, y1, x1 = instance.bbox
+        _, centroids, _ = instance_properties(instance.mask[None])
+        region_colors, _ = dominant_region_colors(new_im[y0:y1, x0:x1], instance.mask[None])
+        map_result.states.append(StateRegion(
+            name=thing_classes[instance.label],
+            centroid=(float(centroids[0][0] + y0), float(centroids[0][1] + x0)),
+            bbox=(int(y0), int(x0), int(y1), int(x1)),
+            color=tuple(int(c) for c in region_colors[0]),
+        ))
+
+
+# ------------------------------------------------------------------------------------------
+# Stage 4: title and legend text extraction (OCR)
+
+def convert_to_doubles(lower_bound, upper_bound):
+    low = lower_bound.replace(",", "")
+    up = upper_bound.replace(",", "")
+
+    if low and not low[-1].isdigit():
+        units = low[-1]
+        low = float(low[:-1])
+    else:
+        units = 'u'
+        low = float(low)
+
+    if up and not up[-1].isdigit():
+        units = up[-1]
+        up = float(up[:-1])
+    else:
+        units = 'u'
+        up = float(up)
+
+    return low, up, units
+
+
+def parse_legend_text(text):
+    """Legend label -> (mid value, units), or None for labels without data such as "N/A"."""
+    if text == "N/A" or text == "-" or not any(char.isdigit() for char in text):
+        return None
+
+    values = text.split("-")
+    if len(values) > 1:
+        lower_bound = values[0]
+        upper_bound = values[1]
+    else:
+        lower_bound = values[0]
+        upper_bound = values[0]
+    converted_lower_bound, converted_upper_bound, units = convert_to_doubles(lower_bound, upper_bound)
+    return (converted_lower_bound + converted_upper_bound) / 2, units
+
+
+def extract_map_legend(ocr_model, images, map_result):
+    file_name = map_result.file_name
+    if map_result.title_bbox is None or map_result.legend_bbox is None:
+        print(f"Skipping OCR for {file_name}: title or legend not found")
+        return
+
+    y0, x0, y1, x1 = map_result.title_bbox
+    cropped_img = images.crop(file_name, y0, y1, x0, x1)
+
+    result = ocr_model.ocr(cropped_img, cls=False)
+    map_result.map_title = result[0][0][1][0]
+
+    y0, x0, y1, x1 = map_result.legend_bbox
+    image = images.crop(file_name, y0, y1, x0, x1)
+
+    result = ocr_model.ocr(image, cls=False)
+
+    for line in result:
+        for word in line:
+            text = word[1][0]
+
+            parsed = parse_legend_text(text)
+            if parsed is None:
+                continue
+
+            swatch = sample_swatch_color(image, word[0])
+            if swatch is None:
+                print(f"No legend swatch found for '{text}' in {file_name}")
+                continue
+
+            blue, green, red = swatch
+            value, units = parsed
+            map_result.legend.append(LegendEntry(value, units, (red, green, blue)))
+
+
+# ------------------------------------------------------------------------------------------
+# Stage 5: state color to legend data mapping
+
+def map_colors_to_data(map_result, color_space="rgb"):
+    """Returns [(file_name, state, assigned_value, assigned_unit)] for one map, empty without a legend."""
+    output_data = []
+    file_name = map_result.file_name
+    if not map_result.legend or not map_result.states:
+        return output_data
+
+    mapType = map_result.map_type
+    if mapType == "discrete":
+        # All states of the map against all legend swatches in one distance matrix
+        nearest = nearest_legend_entries([region.color for region in map_result.states],
+                                         [entry.color for entry in map_result.legend], color_space)
+        for region, index in zip(map_result.states, nearest):
+            entry = map_result.legend[index]
+            output_data.append((file_name, region.name, entry.value, entry.unit))
+    elif mapType == "continuous":
+        assigned_values = interpolate_continuous_values([region.color for region in map_result.states],
+                                                        [entry.color for entry in map_result.legend],
+                                                        [entry.value for entry in map_result.legend])
+        assigned_unit = map_result.legend[0].unit
+        for region, assigned_value in zip(map_result.states, assigned_values):
+            output_data.append((file_name, region.name, float(assigned_value), assigned_unit))
+    return output_data
+
+
+# ------------------------------------------------------------------------------------------
+# Whole map: every stage for one image, in order
+
+STAGE_NAMES = ["classify", "annotate", "segment", "ocr", "map"]
+# Part of the result cache version: bump when a stage's output changes for the same image and models
+STAGES_VERSION = 3
+
+
+def pipeline_settings():
+    """
+    Image limits, state tiling and color matching from the environment. The web
+    app and bulk_ingest.py both read them here, so they process maps alike and
+    share result cache entries.
+    """
+    return {
+        # Larger images are downscaled to max_side when decoded (0 = never)
+        "max_side": int(os.getenv("MAX_IMAGE_SIDE", "6000")),
+        # Images over MAX_IMAGE_MEGAPIXELS are refused: a PNG is decoded at full size before it is
+        # downscaled, so this bounds the memory one image can take (about 3 bytes per pixel)
+        "max_pixels": int(float(os.getenv("MAX_IMAGE_MEGAPIXELS", "250")) * 1_000_000),
+        # STATES_TILING=auto (opt-in) segments images longer than STATES_TILE_MIN_SIDE on overlapping tiles
+        "tiling": TilingConfig(
+            mode=os.getenv("STATES_TILING", "off"),
+            tile_size=int(os.getenv("STATES_TILE_SIZE", "1536")),
+            overlap=int(os.getenv("STATES_TILE_OVERLAP", "256")),
+            min_side=int(os.getenv("STATES_TILE_MIN_SIDE", "3000")),
+            batch_size=DETECTRON2_MAX_BATCH,
+        ),
+        # "rgb" or "lab" (CIELAB): color space for matching states to discrete legend swatches
+        "color_space": os.getenv("COLOR_MATCH_SPACE", "rgb"),
+    }
+
+
+def cache_version(settings):
+    # Everything that changes a cached map_result for the same image bytes; color matching runs after the cache
+    return f"{model_versions()}|stages={STAGES_VERSION}|max_side={settings['max_side']}|{settings['tiling'].describe()}"
+
+
+def process_map(filename, models, images, color_space="rgb", report=None, cache=None, tiling=None, trace=None):
+    """
+    Runs classification, component segmentation, state segmentation, OCR and color
+    mapping for one image. models: {"classifier", "annotation", "states", "ocr"}.
+    report(stage_name) is called as each stage finishes. Returns
+    (map_result, found_components, output_data). Maps without a title and legend
+    skip the remaining stages, since they cannot produce data.
+
+    With a ResultCache, an image seen before (same bytes, same models) skips
+    straight to color mapping; report() also gets "cache_hit" / "cache_miss".
+    tiling: optional TilingConfig for state segmentation of large images.
+    Every stage is timed as a telemetry span, recorded in trace (a JobTrace) if given.
+    """
+    report = report or (lambda stage: None)
+
+    with span("cache_lookup", trace, file=filename):
+        cache_key = cache.key(images.content_hash(filename)) if cache is not None else None
+        cached = cache.get(cache_key) if cache is not None else None
+
+    if cached is not None:
+        report("cache_hit")
+        map_result, found_components = cached
+        map_result.file_name = filename
+        for stage in ("classify", "annotate", "segment", "ocr"):
+            report(stage)
+    else:
+        if cache is not None:
+            report("cache_miss")
+
+        with span("decode", trace, file=filename):
+            shapes = [images.get(filename).shape]
+
+        # These three mostly wait on the batcher threads, whose spans carry the inference CPU time
+        with span("classify", trace, shapes, cpu=None, file=filename):
+            map_result = classify_map(models["classifier"], images, filename)
+        report("classify")
+
+        with span("annotate", trace, shapes, cpu=None, file=filename):
+            found_components = annotate_map(models["annotation"], annotation_class_names, images, map_result)
+        report("annotate")
+
+        if map_result.title_bbox is not None and map_result.legend_bbox is not None:
+            with span("segment", trace, shapes, cpu=None, file=filename):
+                segment_map_states(models["states"], class_names, images, map_result, tiling)
+            report("segment")
+            with span("ocr", trace, shapes, file=filename):
+                extract_map_legend(models["ocr"], images, map_result)
+        else:
+            report("segment")
+        report("ocr")
+
+        if cache is not None:
+            cache.put(cache_key, map_result, found_components)
+
+    with span("map", trace, file=filename, states=len(map_result.states)):
+        output_data = map_colors_to_data(map_result, color_space)
+    report("map")
+    return map_result, found_components, output_data
+
+
+def build_results_table(maps, output_data):
+    """
+    Wide State_Name x map table built with one pivot of the long
+    (file_name, state, value, unit) records. Each map with a legend becomes a
+    column titled "<map title> (<unit>)"; missing and zero values take the
+    column median. Returns (table, column_files, observed): column_files maps each
+    column title to the file it was read from, and observed, the same table
+    before imputation (NaN where a value is missing or zero).
+    """
+    records = pd.DataFrame(output_data, columns=["File_Name", "State_Name", "Value", "Unit"])
+    states = records["State_Name"].unique()
+    records = records[records["File_Name"].isin([f for f, m in maps.items() if m.legend])]
+    if records.empty:
+        return pd.DataFrame(columns=["State_Name"]), {}, pd.DataFrame(columns=["State_Name"])
+
+    # A file's column is titled with the unit of its first record
+    units = records.groupby("File_Name", sort=False)["Unit"].first()
+    titles = {filename: f"{maps[filename].map_title} ({units[filename]})" for filename in maps if filename in units.index}
+    # Maps sharing a title share a column, which holds only the last such file's values
+    column_files = {title: filename for filename, title in titles.items()}
+
+    records = records.assign(Title=records["File_Name"].map(titles))
+    records = records[records["File_Name"] == records["Title"].map(column_files)]
+    table = records.pivot_table(index="State_Name", columns="Title", values="Value", aggfunc="last")
+    table = table.reindex(index=states, columns=list(dict.fromkeys(titles.values())))
+
+    observed = table.mask(table == 0)
+    table = observed.fillna(observed.median())
+
+    for frame in (table, observed):
+        frame.index.name, frame.columns.name = "State_Name", None
+    return table.reset_index(), column_files, observed.reset_index()
+
+
+def with_file_name_row(table, column_files):
+    # data.csv and the frontend carry the title -> file mapping as a trailing "File_Name" row
+    row = pd.DataFrame([{"State_Name": "File_Name", **column_files}])
+    return pd.concat([table, row], ignore_index=True)
@@ -1,56 +1,157 @@
 from groq import Groq
+import collections
+import hashlib
 import os
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-client = Groq(
-    api_key=os.getenv("GROQ_API_KEY"),
-)
+from utils.telemetry import span
 
 prompting_model="deepseek-r1-distill-llama-70b"
 summary_model="deepseek-r1-distill-llama-70b"
 
+
+class StubClient:
+    """
+    Stand-in for the Groq client (SUMMARY_BACKEND=stub): answers every chat
+    completion locally so the pipeline runs without the API.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.chat = self
+        self.completions = self
+
+    def create(self, messages, model):
+        self.calls.append({"messages": messages, "model": model})
+        content = f"[stub summary] {messages[-1]['content'][:200]}"
+        message = type("Message", (), {"content": content})()
+        choice = type("Choice", (), {"message": message})()
+        return type("Completion", (), {"choices": [choice]})()
+
+
+def make_client():
+    # Only on request: a missing GROQ_API_KEY must not turn into stub text shown as the summary
+    if os.getenv("SUMMARY_BACKEND") == "stub":
+        return StubClient()
+    return Groq(api_key=os.getenv("GROQ_API_KEY"))
+
+
 def remove_think_tags(text):
     # Remove all content between <think> and </think> tags (including tags themselves)
     return re.sub(r'<think>.*?</think>', '', text, flags=re.DOTALL).strip()
 
-def generate_summary(column_headers, csv_content):
-    try:
-        prompting_response = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a data scientist and assistant. You provide only an AI prompt and many analytical questions, nothing else. Don't say 'here is the prompt' or any similar phrase."
-                },
-                {
-                    "role": "user",
-                    "content": f"I have extracted data from choropleth maps. I will provide data related to following titles: {column_headers}. I want to analyze state-wise trends and get useful insights. Give me a natural language prompt to input with this data into an LLM to extract maximum textual insights. mention in the prompt not to return code or visualizations. mention give paragraphs and not lot of bullets points. If column titles seem unrelated, ask to split summaries accordingly.",
-                }
-            ],
-            model=prompting_model,
-        )
-
-        prompting_response_text = prompting_response.choices[0].message.content
-        prompting_response_text = remove_think_tags(prompting_response_text)
-
-
-        summary_response = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "system",
-                    "content": "you are a data scientist."
-                },
-                {
-                    "role": "user",
-                    "content": f"{prompting_response_text}. CSV Data is as follows (each state related data is separated by new line or \n): {csv_content}",
-                }
-            ],
-            model=summary_model,
-        )
-
-        summary_response_text = summary_response.choices[0].message.content
-        summary_response_text = remove_think_tags(summary_response_text)
-
-        return summary_response_text
-    except Exception as e:
-        print(f"An unexpected error occurred while generating summary: {e}")
-        return "Failed generate summary!"
\ No newline at end of file
+
+def generate_prompt(column_headers, client):
+    prompting_response = client.chat.completions.create(
+        messages=[
+            {
+                "role": "system",
+                "content": "You are a data scientist and assistant. You provide only an AI prompt and many analytical questions, nothing else. Don't say 'here is the prompt' or any similar phrase."
+            },
+            {
+                "role": "user",
+                "content": f"I have extracted data from choropleth maps. I will provide data related to following titles: {column_headers}. I want to analyze state-wise trends and get useful insights. Give me a natural language prompt to input with this data into an LLM to extract maximum textual insights. mention in the prompt not to return code or visualizations. mention give paragraphs and not lot of bullets points. If column titles seem unrelated, ask to split summaries accordingly.",
+            }
+        ],
+        model=prompting_model,
+    )
+
+    prompting_response_text = prompting_response.choices[0].message.content
+    return remove_think_tags(prompting_response_text)
+
+
+def generate_data_summary(prompting_response_text, csv_content, client):
+    summary_response = client.chat.completions.create(
+        messages=[
+            {
+                "role": "system",
+                "content": "you are a data scientist."
+            },
+            {
+                "role": "user",
+                "content": f"{prompting_response_text}. Data is as follows (column ids with titles, precomputed stats per column, then one state per line as CSV): {csv_content}",
+            }
+        ],
+        model=summary_model,
+    )
+
+    summary_response_text = summary_response.choices[0].message.content
+    return remove_think_tags(summary_response_text)
+
+
+class TTLCache:
+    # Small thread-safe LRU whose entries also expire after ttl seconds
+    def __init__(self, max_items=256, ttl=24 * 60 * 60):
+        self.max_items = max_items
+        self.ttl = ttl
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = (value, time.monotonic() + self.ttl)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+
+def normalize_headers(column_headers):
+    return ",".join(header.strip().lower() for header in column_headers.split(","))
+
+
+class SummaryService:
+    """
+    Two-step LLM summary with caching and background execution. The generated
+    prompt depends only on the column titles, so it is cached by normalized
+    headers; finished summaries are cached by a hash of the data. submit()
+    returns a Future, letting the pipeline deliver results before the summary.
+    """
+
+    def __init__(self, client=None, max_workers=4, max_items=256, ttl=24 * 60 * 60):
+        self.client = client or make_client()
+        self.prompts = TTLCache(max_items, ttl)
+        self.summaries = TTLCache(max_items, ttl)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="summary")
+
+    def summarize(self, column_headers, csv_content, trace=None):
+        with span("summary", trace):
+            return self._summarize(column_headers, csv_content)
+
+    def _summarize(self, column_headers, csv_content):
+        summary_key = hashlib.sha256(f"{column_headers}\n{csv_content}".encode()).hexdigest()
+        summary = self.summaries.get(summary_key)
+        if summary is not None:
+            return summary
+
+        try:
+            prompt_key = normalize_headers(column_headers)
+            prompting_response_text = self.prompts.get(prompt_key)
+            if prompting_response_text is None:
+                prompting_response_text = generate_prompt(column_headers, self.client)
+                self.prompts.put(prompt_key, prompting_response_text)
+
+            summary = generate_data_summary(prompting_response_text, csv_content, self.client)
+        except Exception as e:
+            print(f"An unexpected error occurred while generating summary: {e}")
+            return "Failed generate summary!"
+
+        self.summaries.put(summary_key, summary)
+        return summary
+
+    def submit(self, column_headers, csv_content, trace=None):
+        return self._executor.submit(self.summarize, column_headers, csv_content, trace)
@@ -0,0 +1,94 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+
+CHARS_PER_TOKEN = 4     # rough average for English text and numbers
+TITLE_UNIT = re.compile(r"^(.*?)\s*\(([^()]*)\)$")
+
+
+def round_sig(value, sig_figs=3):
+    if value is None or pd.isna(value):
+        return ""
+    return f"{float(value):.{sig_figs}g}"
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def split_title_unit(column):
+    # Result columns are named "<map title> (<unit>)"
+    match = TITLE_UNIT.match(column)
+    if match:
+        return match.group(1), match.group(2).strip()
+    return column, ""
+
+
+def column_stats(name, values, states, sig_figs, top_n):
+    valid = values.notna()
+    values, states = values[valid].to_numpy(dtype=float), states[valid].to_numpy()
+    if not len(values):
+        return f"{name}: no data"
+
+    q25, median, q75 = np.quantile(values, [0.25, 0.5, 0.75])
+    order = np.argsort(values, kind="stable")
+    top = ", ".join(f"{states[i]} {round_sig(values[i], sig_figs)}" for i in order[::-1][:top_n])
+    bottom = ", ".join(f"{states[i]} {round_sig(values[i], sig_figs)}" for i in order[:top_n])
+    stats = ", ".join([f"n {len(values)}"] + [f"{label} {round_sig(v, sig_figs)}" for label, v in
+                      [("min", values[order[0]]), ("q25", q25), ("median", median),
+                       ("q75", q75), ("max", values[order[-1]]), ("mean", values.mean())]])
+    return f"{name}: {stats}; top: {top}; bottom: {bottom}"
+
+
+def build_summary_input(df, sig_figs=3, top_n=3, token_budget=None):
+    """
+    Compact text encoding of the results table for the LLM summary.
+    df should hold only observed values (the `observed` table of
+    build_results_table): missing readings stay empty instead of showing the
+    imputed median. Map titles are replaced by short column ids (C1, C2, ...)
+    with each unit stated once, values are rounded to sig_figs significant
+    figures, and per-column stats plus top/bottom states are precomputed over
+    the states with a value (n).
+    If the text exceeds token_budget (estimated), state rows are dropped from
+    the end; the stats still describe every state.
+
+    Returns (column_headers, content) for SummaryService.
+    """
+    columns = list(df.columns[1:])
+    states = df["State_Name"].astype(str)
+
+    titles, units = zip(*(split_title_unit(column) for column in columns)) if columns else ((), ())
+    shared_unit = units[0] if units and len(set(units)) == 1 else None
+    ids = [f"C{i + 1}" for i in range(len(columns))]
+
+    lines = ["Columns:"]
+    if shared_unit:
+        lines.append(f"(all values in {shared_unit})")
+    for column_id, title, unit in zip(ids, titles, units):
+        lines.append(f"{column_id} = {title}" + (f" [{unit}]" if unit and not shared_unit else ""))
+
+    lines.append(f"Stats over the states with a value, of {len(df)} states:")
+    for column_id, column in zip(ids, columns):
+        values = pd.to_numeric(df[column], errors="coerce")
+        lines.append(column_stats(column_id, values, states, sig_figs, top_n))
+
+    lines.append("Data (State," + ",".join(ids) + "; empty = no value read for that state):")
+    rows = [",".join([state] + [round_sig(v, sig_figs) for v in pd.to_numeric(row, errors="coerce")])
+            for state, row in zip(states, df[columns].itertuples(index=False))]
+
+    header = "\n".join(lines)
+    if token_budget:
+        budget = token_budget - estimate_tokens(header) - 20
+        kept = []
+        for row in rows:
+            budget -= estimate_tokens(row)
+            if budget < 0:
+                break
+            kept.append(row)
+        if len(kept) < len(rows):
+            kept.append(f"... {len(rows) - len(kept)} more states omitted")
+        rows = kept
+
+    return ",".join(columns), header + "\n" + "\n".join(rows)
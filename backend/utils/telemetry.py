@@ -0,0 +1,260 @@
+import json
+import os
+import resource
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+
+# Latency buckets in seconds, from a cheap color-mapping step up to a slow LLM call
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+MEMORY_BUCKETS = tuple(2 ** power * 1024 * 1024 for power in range(0, 13))   # 1 MiB .. 4 GiB
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def peak_rss():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Metrics:
+    """
+    Minimal Prometheus registry: labelled counters and histograms, rendered in
+    the text exposition format by render().
+
+    With a directory (METRICS_DIR), every process flushes its values to its own
+    file there and render() sums all of them, in the manner of prometheus_client's
+    multiprocess mode, so a scrape answered by any gunicorn worker covers all of
+    them. Files of exited workers stay and keep counting; the directory is
+    cleared when the server starts (see gunicorn.conf.py). Without a directory
+    the values are those of the current process only.
+    """
+
+    def __init__(self, directory=None, flush_interval=1.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._help = {}
+        self._counters = {}     # (name, labels) -> value
+        self._histograms = {}   # (name, labels) -> [bucket counts, sum, count]
+        self._buckets = {}
+        self._pid = None
+        self._file = None
+        self._dirty = False
+
+    def describe(self, name, kind, help_text, buckets=None):
+        self._help[name] = (kind, help_text)
+        if buckets is not None:
+            self._buckets[name] = buckets
+
+    def _changed(self):
+        # Called with the lock held
+        if self.directory and self._pid != os.getpid():
+            # First update in this process; values inherited through fork belong to the parent's file
+            self._counters, self._histograms = {}, {}
+            self._pid = os.getpid()
+            self._file = os.path.join(self.directory, f"{self._pid}-{uuid.uuid4().hex[:8]}.json")
+            threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True).start()
+        self._dirty = True
+
+    def inc(self, name, labels=(), value=1):
+        with self._lock:
+            self._changed()
+            key = (name, tuple(labels))
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        buckets = self._buckets[name]
+        with self._lock:
+            self._changed()
+            key = (name, tuple(labels))
+            entry = self._histograms.setdefault(key, [[0] * len(buckets), 0.0, 0])
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def _flush_loop(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            if not self._dirty or self._pid != os.getpid():
+                return
+            values = {
+                "counters": [[name, labels, value] for (name, labels), value in self._counters.items()],
+                "histograms": [[name, labels, *entry] for (name, labels), entry in self._histograms.items()],
+            }
+            self._dirty = False
+            path = self._file
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(values, file)
+        os.replace(tmp_path, path)
+
+    def _collect(self):
+        """(counters, histograms) summed over every process' file, or this process' own values."""
+        if not self.directory:
+            with self._lock:
+                return dict(self._counters), {key: [list(c), s, n] for key, (c, s, n) in self._histograms.items()}
+
+        self.flush()
+        counters, histograms = {}, {}
+        try:
+            names = [name for name in os.listdir(self.directory) if name.endswith(".json")]
+        except OSError:
+            names = []
+        for name in names:
+            try:
+                with open(os.path.join(self.directory, name), encoding="utf-8") as file:
+                    values = json.load(file)
+            except (OSError, ValueError):
+                continue
+            for metric, labels, value in values["counters"]:
+                key = (metric, tuple(tuple(pair) for pair in labels))
+                counters[key] = counters.get(key, 0) + value
+            for metric, labels, counts, total, count in values["histograms"]:
+                key = (metric, tuple(tuple(pair) for pair in labels))
+                entry = histograms.setdefault(key, [[0] * len(counts), 0.0, 0])
+                entry[0] = [a + b for a, b in zip(entry[0], counts)]
+                entry[1] += total
+                entry[2] += count
+        return counters, histograms
+
+    def render(self):
+        def label_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+        counters, histograms = self._collect()
+        lines = []
+        for name, (kind, help_text) in sorted(self._help.items()):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            if kind == "counter":
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{label_text(labels)} {value}")
+                continue
+            buckets = self._buckets[name]
+            for (metric, labels), (counts, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, bucket_count in zip(buckets, counts):
+                    lines.append(f"{name}_bucket{label_text(labels, [('le', bound)])} {bucket_count}")
+                lines.append(f"{name}_bucket{label_text(labels, [('le', '+Inf')])} {count}")
+                lines.append(f"{name}_sum{label_text(labels)} {total}")
+                lines.append(f"{name}_count{label_text(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics(os.getenv("METRICS_DIR") or None)
+metrics.describe("cma_stage_wall_seconds", "histogram", "Wall time of one pipeline stage span.", LATENCY_BUCKETS)
+metrics.describe("cma_stage_cpu_seconds", "histogram",
+                 "CPU time of a stage span; clock=thread is the span's own thread, clock=process all threads.",
+                 LATENCY_BUCKETS)
+metrics.describe("cma_stage_rss_delta_bytes", "histogram", "Growth of process RSS over a stage span.", MEMORY_BUCKETS)
+metrics.describe("cma_stage_images_total", "counter", "Images processed per stage.")
+metrics.describe("cma_stage_pixels_total", "counter", "Pixels of the images processed per stage.")
+metrics.describe("cma_job_seconds", "histogram", "Wall time of a whole job, upload to summary.", LATENCY_BUCKETS)
+metrics.describe("cma_jobs_total", "counter", "Finished jobs by outcome.")
+
+
+class JobTrace:
+    """
+    Collects the spans of one job. finish() records the job duration and, when
+    trace_dir is set, writes every span to <trace_dir>/<job_id>.json.
+    """
+
+    def __init__(self, job_id, trace_dir=None):
+        self.job_id = job_id
+        self.trace_dir = trace_dir
+        self.started = time.perf_counter()
+        self.started_at = time.time()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, record):
+        with self._lock:
+            self.spans.append(record)
+
+    def finish(self, outcome):
+        seconds = time.perf_counter() - self.started
+        metrics.observe("cma_job_seconds", [], seconds)
+        metrics.inc("cma_jobs_total", [("outcome", outcome)])
+        if not self.trace_dir:
+            return
+        os.makedirs(self.trace_dir, exist_ok=True)
+        with self._lock:
+            trace = {"job_id": self.job_id, "started_at": self.started_at, "seconds": round(seconds, 4),
+                     "outcome": outcome, "spans": list(self.spans)}
+        with open(os.path.join(self.trace_dir, f"{self.job_id}.json"), "w", encoding="utf-8") as file:
+            json.dump(trace, file, indent=2)
+
+
+CPU_CLOCKS = {"thread": time.thread_time, "process": time.process_time}
+
+
+@contextmanager
+def span(stage, trace=None, image_shapes=(), cpu="thread", **attributes):
+    """
+    with span("segment", trace, [image.shape], file=filename): ...
+
+    Measures wall time, CPU time and the process RSS growth (and peak RSS
+    growth) over the block, feeds the stage histograms, and adds the record to
+    `trace` when one is given.
+
+    cpu picks the CPU clock: "thread" counts only the thread running the block,
+    "process" every thread of the process, which is what includes the intra-op
+    threads of torch / OpenMP but also whatever else runs meanwhile. None
+    records no CPU time, for spans that mostly wait on another thread (their
+    wall time is then wait time, and the CPU shows up in that thread's spans).
+    """
+    shapes = [tuple(int(v) for v in shape[:2]) for shape in image_shapes]
+    clock = CPU_CLOCKS.get(cpu)
+    rss, peak = current_rss(), peak_rss()
+    cpu_start, wall_start = clock() if clock else None, time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = repr(e)
+        raise
+    finally:
+        wall = time.perf_counter() - wall_start
+        cpu_seconds = clock() - cpu_start if clock else None
+        rss_delta = current_rss() - rss
+        peak_delta = peak_rss() - peak
+
+        labels = [("stage", stage)]
+        metrics.observe("cma_stage_wall_seconds", labels, wall)
+        if clock:
+            metrics.observe("cma_stage_cpu_seconds", labels + [("clock", cpu)], cpu_seconds)
+        metrics.observe("cma_stage_rss_delta_bytes", labels, max(rss_delta, 0))
+        if shapes:
+            metrics.inc("cma_stage_images_total", labels, len(shapes))
+            metrics.inc("cma_stage_pixels_total", labels, sum(h * w for h, w in shapes))
+
+        if trace is not None:
+            trace.add({
+                "stage": stage, "thread": threading.current_thread().name,
+                "start": round(wall_start - trace.started, 4), "wall_seconds": round(wall, 4),
+                "cpu_seconds": round(cpu_seconds, 4) if clock else None, "cpu_clock": cpu,
+                "rss_delta_bytes": rss_delta, "peak_rss_delta_bytes": peak_delta,
+                "images": len(shapes), "dimensions": shapes, "error": error, **attributes,
+            })
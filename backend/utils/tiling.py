@@ -0,0 +1,102 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+
+@dataclass
+class TilingConfig:
+    mode: str = "off"       # "off", "on", or "auto": tile images whose longest side exceeds min_side
+    tile_size: int = 1536
+    overlap: int = 256
+    min_side: int = 3000
+    batch_size: int = 4     # tiles in flight at once, bounds the memory of one image's inference
+
+    def should_tile(self, shape):
+        if self.mode == "on":
+            return True
+        return self.mode == "auto" and max(shape[:2]) > self.min_side
+
+    def describe(self):
+        # Part of the result cache version: tiled and untiled runs give different regions
+        if self.mode == "off":
+            return "tiling=off"
+        return f"tiling={self.mode}:{self.tile_size}/{self.overlap}/{self.min_side}"
+
+
+def tile_grid(height, width, tile_size, overlap):
+    """(y0, x0, y1, x1) windows covering the image, neighbours sharing `overlap` pixels."""
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        step = tile_size - overlap
+        positions = list(range(0, length - tile_size, step))
+        return positions + [length - tile_size]     # last tile flush with the edge
+
+    return [(y, x, min(y + tile_size, height), min(x + tile_size, width))
+            for y in starts(height) for x in starts(width)]
+
+
+@dataclass
+class TileInstance:
+    label: int
+    bbox: tuple     # (y0, x0, y1, x1) in image coordinates, exclusive ends
+    mask: np.ndarray    # bool, cropped to bbox
+
+
+def tile_instances(masks, labels, window):
+    """Cuts one tile's (N, h, w) masks down to their bounding boxes, in image coordinates."""
+    ty, tx = window[:2]
+    found = []
+    for mask, label in zip(masks, labels):
+        rows = np.flatnonzero(mask.any(axis=1))
+        cols = np.flatnonzero(mask.any(axis=0))
+        if not len(rows):
+            continue
+        y0, y1, x0, x1 = int(rows[0]), int(rows[-1]) + 1, int(cols[0]), int(cols[-1]) + 1
+        found.append(TileInstance(int(label), (ty + y0, tx + x0, ty + y1, tx + x1), mask[y0:y1, x0:x1].copy()))
+    return found
+
+
+def _touching(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def merge_instances(instances):
+    """
+    Joins detections of the same class whose boxes touch or overlap - the halves
+    of a state cut by a tile seam, or the same state seen twice in an overlap
+    band - into one instance whose mask is the union of theirs.
+    """
+    parent = list(range(len(instances)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, a in enumerate(instances):
+        for j in range(i + 1, len(instances)):
+            b = instances[j]
+            if a.label == b.label and _touching(a.bbox, b.bbox):
+                parent[find(j)] = find(i)
+
+    groups = {}
+    for i in range(len(instances)):
+        groups.setdefault(find(i), []).append(instances[i])
+
+    merged = []
+    for group in groups.values():
+        if len(group) == 1:
+            merged.append(group[0])
+            continue
+        y0 = min(inst.bbox[0] for inst in group)
+        x0 = min(inst.bbox[1] for inst in group)
+        y1 = max(inst.bbox[2] for inst in group)
+        x1 = max(inst.bbox[3] for inst in group)
+        mask = np.zeros((y1 - y0, x1 - x0), dtype=bool)
+        for inst in group:
+            iy0, ix0, iy1, ix1 = inst.bbox
+            mask[iy0 - y0:iy1 - y0, ix0 - x0:ix1 - x0] |= inst.mask
+        merged.append(TileInstance(group[0].label, (y0, x0, y1, x1), mask))
+    return merged
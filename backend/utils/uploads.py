@@ -0,0 +1,87 @@
+import hashlib
+import json
+import os
+import shutil
+
+from werkzeug.utils import secure_filename
+
+from utils.image_store import IMAGE_EXTENSIONS, MANIFEST, ImageTooLargeError, check_pixels
+
+
+CHUNK_SIZE = 1024 * 1024
+IMAGE_SIGNATURES = {
+    ".png": (b"\x89PNG\r\n\x1a\n",),
+    ".jpg": (b"\xff\xd8\xff",),
+    ".jpeg": (b"\xff\xd8\xff",),
+}
+
+
+class UploadError(Exception):
+    pass
+
+
+def save_upload(file, target_dir, max_pixels=None):
+    """
+    Streams one werkzeug FileStorage into target_dir in chunks, hashing it on
+    the way. The first chunk must carry a PNG/JPEG signature matching the
+    extension, so non-images are rejected before the rest is read, and the
+    header must declare at most max_pixels pixels.
+    Returns (filename, sha256 hex digest).
+    """
+    filename = secure_filename(file.filename)
+    extension = os.path.splitext(filename)[1].lower()
+    if extension not in IMAGE_EXTENSIONS:
+        raise UploadError(f"Unsupported file type: {file.filename}")
+
+    chunk = file.stream.read(CHUNK_SIZE)
+    if not chunk.startswith(IMAGE_SIGNATURES[extension]):
+        raise UploadError(f"Not a valid image: {file.filename}")
+
+    sha = hashlib.sha256()
+    path = os.path.join(target_dir, filename)
+    with open(path, "wb") as out:
+        while chunk:
+            sha.update(chunk)
+            out.write(chunk)
+            chunk = file.stream.read(CHUNK_SIZE)
+
+    try:
+        check_pixels(path, max_pixels)
+    except ImageTooLargeError as e:
+        os.remove(path)
+        raise UploadError(str(e))
+    except OSError:
+        os.remove(path)
+        raise UploadError(f"Not a valid image: {file.filename}")
+    return filename, sha.hexdigest()
+
+
+def link_or_copy(source, target):
+    # Same filesystem -> hard link, no second write; otherwise fall back to a copy
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def ingest_uploads(files, results_dir, upload_dir, max_pixels=None):
+    """
+    Writes each upload once into the session's results folder (where it is
+    served from) and hard-links it into the pipeline's upload folder, which is
+    deleted after the job. Content hashes go to upload_dir/manifest.json so the
+    result cache does not need to read the files again.
+    """
+    os.makedirs(results_dir, exist_ok=True)
+    os.makedirs(upload_dir, exist_ok=True)
+
+    hashes = {}
+    for file in files:
+        filename, content_hash = save_upload(file, results_dir, max_pixels)
+        hashes[filename] = content_hash
+
+    for filename in hashes:
+        link_or_copy(os.path.join(results_dir, filename), os.path.join(upload_dir, filename))
+
+    with open(os.path.join(upload_dir, MANIFEST), "w", encoding="utf-8") as manifest:
+        json.dump(hashes, manifest)
+    return list(hashes)
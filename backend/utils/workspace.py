@@ -0,0 +1,45 @@
+import os
+import shutil
+import time
+
+
+class Workspace:
+    """
+    Private scratch directory for one pipeline job (outputs/<session_id>).
+    Stages read and write their intermediate files through ws.path(name), so
+    concurrent jobs never touch each other's files. Removed on exit.
+    """
+
+    def __init__(self, root, session_id):
+        self.session_id = session_id
+        self.dir = os.path.join(root, session_id)
+        os.makedirs(self.dir, exist_ok=True)
+
+    def path(self, filename):
+        return os.path.join(self.dir, filename)
+
+    def exists(self, filename):
+        return os.path.exists(self.path(filename))
+
+    def cleanup(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.cleanup()
+        return False
+
+
+def cleanup_stale_workspaces(root, max_age_seconds):
+    # Workspaces left behind by a crashed worker; live jobs keep touching theirs
+    now = time.time()
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        try:
+            if os.path.isdir(path) and now - os.path.getmtime(path) > max_age_seconds:
+                shutil.rmtree(path, ignore_errors=True)
+                print(f"Removed stale workspace: {path}")
+        except OSError as e:
+            print(f"Error checking workspace {path}: {e}")
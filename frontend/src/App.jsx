@@ -110,6 +110,17 @@ function App() {
           
           if (data.Results) {
             setResults(data.Results);
+            // The summary may still be generating; it then arrives as its own "summary" event
+            if (!data.summary_pending) {
+              setAIGeneratedSummary(data.Summary);
+              source.close();
+            }
+          }
+          if(data.status==="error") {
+            setError(data.error || "Processing failed, please try again.");
+            source.close();
+          }
+          if(data.status==="summary") {
             setAIGeneratedSummary(data.Summary);
             source.close();
           }
@@ -130,8 +141,11 @@ function App() {
       };
       
       source.onerror = () => {
-        source.close();
-        setError("Error receiving updatesHELLO");
+        // The browser reconnects on its own and the server resumes after the last event id;
+        // only a stream the browser gave up on is an error
+        if (source.readyState === EventSource.CLOSED) {
+          setError("Error receiving updatesHELLO");
+        }
       };
     } catch (err) {
       console.error(err);